@@ -0,0 +1,184 @@
+"""Vectorised attendance analytics for one batch and subject.
+
+`load_matrix()` reads the batch and subject with three queries into dense students x lectures
+boolean matrices; every metric is then a NumPy operation over the whole batch at once. The marks
+come either from the attendance rows or, with ATTENDANCE_STORAGE=bitmap, from one bitmap row per
+lecture, unpacked byte-wise with `present & marked` so the counts are sums of set bits.
+"""
+from itertools import chain
+import numpy as np
+from models import db, Student, Lecture, Attendance, LectureBitmap
+
+
+def position_of(ids, values):
+    # Index of each value in the id array `ids`, which may be in any order
+    order = np.argsort(ids)
+    return order[np.searchsorted(ids, values, sorter=order)]
+
+
+class AttendanceMatrix:
+    def __init__(self, students, lectures, present, recorded):
+        self.students = students  # [(id, student_name, enrollment_number)] by enrollment number
+        self.lectures = lectures  # [(id, timestamp, sequence_number)] by timestamp
+        self.present = present  # students x lectures, True where marked present
+        self.recorded = recorded  # students x lectures, True where attendance was taken
+
+    @property
+    def absent(self):
+        return self.recorded & ~self.present
+
+    def attended(self):
+        return self.present.sum(axis=1)
+
+    def total(self):
+        return self.recorded.sum(axis=1)
+
+    def percentage(self, present=None, recorded=None):
+        present = self.present if present is None else present
+        recorded = self.recorded if recorded is None else recorded
+        total = recorded.sum(axis=1)
+        return np.divide(100.0 * present.sum(axis=1), total, out=np.zeros(len(total)), where=total > 0)
+
+    def recent_percentage(self, last):
+        # Percentage over each student's last `last` lectures of the subject; a slice from -0
+        # would take every lecture, and a negative one drop the first lectures instead
+        last = max(last, 1)
+        return self.percentage(self.present[:, -last:], self.recorded[:, -last:])
+
+    def longest_absence_streak(self):
+        # Lengths of runs of consecutive absences, found from the edges of each run
+        padded = np.zeros((len(self.students), len(self.lectures) + 2), dtype=np.int8)
+        padded[:, 1:-1] = self.absent
+        edges = np.diff(padded, axis=1)
+        rows, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1)
+
+        streaks = np.zeros(len(self.students), dtype=np.int64)
+        np.maximum.at(streaks, rows, ends - starts)
+        return streaks
+
+    def cumulative_percentage(self):
+        # students x lectures: each student's percentage as of every lecture
+        attended = np.cumsum(self.present, axis=1)
+        total = np.cumsum(self.recorded, axis=1)
+        return np.divide(100.0 * attended, total, out=np.full(total.shape, np.nan), where=total > 0)
+
+    def below_threshold_after(self, lecture_index, threshold):
+        # Students whose percentage was under the threshold once the given lecture was taken
+        return self.cumulative_percentage()[:, lecture_index] < threshold
+
+    def lectures_to_recover(self, threshold):
+        # Consecutive lectures each student must attend to reach the threshold:
+        # the smallest x with (attended + x) / (total + x) >= threshold
+        ratio = threshold / 100.0
+        attended = self.attended()
+        total = self.total()
+        if ratio >= 1:
+            return np.where(attended < total, -1, 0)
+        needed = np.ceil((ratio * total - attended) / (1 - ratio) - 1e-9)
+        return np.maximum(needed, 0).astype(np.int64)
+
+    def lecture_index(self, sequence_number):
+        for index, lecture in enumerate(self.lectures):
+            if lecture[2] == sequence_number:
+                return index
+        return None
+
+
+def bitmap_bytes(bitmaps, size):
+    # lectures x size array of the bytes of each bitmap, zero-padded to the same length
+    buffer = b''.join(bitmap.ljust(size, b'\0') for bitmap in bitmaps)
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(len(bitmaps), size)
+
+
+def load_bitmap_marks(lecture_ids, batch_indexes):
+    """students x lectures (present, recorded) matrices from the bitmaps of the lectures."""
+    stored = dict((row[0], row[1:]) for row in db.session.connection().execute(
+        db.select(LectureBitmap.lecture_id, LectureBitmap.marked, LectureBitmap.present)
+        .where(LectureBitmap.lecture_id.in_(lecture_ids))
+    ))
+    bitmaps = [stored.get(lecture_id, (b'', b'')) for lecture_id in lecture_ids]
+    indexes = [index for index in batch_indexes if index is not None]
+    size = max([len(marked) for marked, _ in bitmaps] + [max(indexes, default=-1) // 8 + 1])
+
+    marked = bitmap_bytes([marked for marked, _ in bitmaps], size)
+    present = bitmap_bytes([present for _, present in bitmaps], size) & marked
+    # One extra, always empty bit column stands in for students without an index yet
+    width = size * 8
+    columns = np.asarray([width if index is None else index for index in batch_indexes], dtype=np.int64)
+
+    def unpack(matrix):
+        bits = np.unpackbits(matrix, axis=1, bitorder='little').astype(bool)
+        return np.hstack([bits, np.zeros((len(lecture_ids), 1), dtype=bool)])[:, columns].T
+
+    return unpack(present), unpack(marked)
+
+
+def load_matrix(batch_id, subject_id, bitmaps=False):
+    """Load the attendance of a batch in a subject with a fixed number of queries."""
+    students = db.session.execute(
+        db.select(Student.id, Student.student_name, Student.enrollment_number, Student.batch_index)
+        .where(Student.batch_id == batch_id)
+        .order_by(Student.enrollment_number)
+    ).all()
+    batch_indexes = [student[3] for student in students]
+    students = [tuple(student[:3]) for student in students]
+    lectures = db.session.execute(
+        db.select(Lecture.id, Lecture.timestamp, Lecture.sequence_number)
+        .where(Lecture.batch_id == batch_id, Lecture.subject_id == subject_id)
+        .order_by(Lecture.timestamp, Lecture.id)
+    ).all()
+
+    present = np.zeros((len(students), len(lectures)), dtype=bool)
+    recorded = np.zeros_like(present)
+    if not students or not lectures:
+        return AttendanceMatrix(students, lectures, present, recorded)
+
+    if bitmaps:
+        present, recorded = load_bitmap_marks([lecture[0] for lecture in lectures], batch_indexes)
+        return AttendanceMatrix(students, lectures, present, recorded)
+
+    # The bulk of the data is three integers per mark, read straight into one flat array
+    # instead of going through per-row objects
+    marks = db.session.connection().execute(
+        db.select(Attendance.student_id, Attendance.lecture_id, db.cast(Attendance.status, db.Integer))
+        .join(Lecture, Lecture.id == Attendance.lecture_id)
+        .join(Student, Student.id == Attendance.student_id)
+        .where(Lecture.batch_id == batch_id, Lecture.subject_id == subject_id, Student.batch_id == batch_id)
+    ).all()
+    values = np.fromiter(chain.from_iterable(marks), dtype=np.int64, count=3 * len(marks)).reshape(-1, 3)
+
+    rows = position_of(np.asarray([student[0] for student in students]), values[:, 0])
+    columns = position_of(np.asarray([lecture[0] for lecture in lectures]), values[:, 1])
+    recorded[rows, columns] = True
+    present[rows, columns] = values[:, 2].astype(bool)
+    return AttendanceMatrix(students, lectures, present, recorded)
+
+
+def student_metrics(matrix, threshold, last=10, after_lecture=None):
+    """Per-student metrics of a matrix as a list of dicts keyed like the attendance report."""
+    attended = matrix.attended()
+    total = matrix.total()
+    percentage = matrix.percentage()
+    recent = matrix.recent_percentage(last)
+    streaks = matrix.longest_absence_streak()
+    to_recover = matrix.lectures_to_recover(threshold)
+    below_after = None
+    if after_lecture is not None and len(matrix.lectures):
+        below_after = matrix.below_threshold_after(after_lecture, threshold)
+
+    metrics = []
+    for i, (student_id, student_name, enrollment_number) in enumerate(matrix.students):
+        metrics.append({
+            'student_id': student_id,
+            'student_name': student_name,
+            'enrollment_number': enrollment_number,
+            'attended': int(attended[i]),
+            'total': int(total[i]),
+            'percentage': round(float(percentage[i]), 2),
+            'recent_percentage': round(float(recent[i]), 2),
+            'longest_absence_streak': int(streaks[i]),
+            'lectures_to_recover': int(to_recover[i]),
+            'below_threshold_after_lecture': bool(below_after[i]) if below_after is not None else None
+        })
+    return metrics
@@ -0,0 +1,238 @@
+"""Archival of closed academic terms.
+
+`archive_term()` moves the lectures of a term and their attendance out of the live tables into
+gzip-compressed JSON Lines files, one lecture or attendance record per line:
+
+    ARCHIVE_DIR/manifest.json
+    ARCHIVE_DIR/<term>/lectures.jsonl.gz
+    ARCHIVE_DIR/<term>/attendance.jsonl.gz
+
+The manifest lists every archived term with its date range, row counts and file checksums.
+Terms are archived oldest first, so every subject's archived lectures precede its live ones and
+`Subject.archived_lectures` keeps the numbering of the live lectures unchanged. The daily
+attendance rollups keep the archived days, which `AttendanceRollup.rebuild()` leaves alone. The
+files are written and synced to disk before the rows are deleted, and a term is only added to
+the manifest once the deletion has committed, so no lecture is ever both live and listed.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from datetime import datetime
+from models import db, Subject, Lecture, Attendance, AttendanceStats, utcnow
+
+MANIFEST = 'manifest.json'
+LECTURES_FILE = 'lectures.jsonl.gz'
+ATTENDANCE_FILE = 'attendance.jsonl.gz'
+CHUNK_SIZE = 1000
+
+term_name_re = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'terms': []}
+    with open(path, encoding='utf-8') as manifest:
+        return json.load(manifest)
+
+
+def save_manifest(directory, manifest):
+    # Written next to the old manifest and renamed over it, so readers never see half a file
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.stream = gzip.GzipFile(fileobj=self.file, mode='wb')
+        self.count = 0
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+        self.count += 1
+
+    def close(self):
+        self.stream.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        return {'file': os.path.basename(self.path), 'rows': self.count, 'sha256': file_digest(self.path)}
+
+
+def read_jsonl(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as stream:
+        for line in stream:
+            yield json.loads(line)
+
+
+def check_term(manifest, name, starts_at, ends_at):
+    if not term_name_re.match(name):
+        raise ArchiveError("Term names may only contain letters, digits, '.', '_' and '-'.")
+    if starts_at >= ends_at:
+        raise ArchiveError("The term must end after it starts.")
+    # Lectures of a running term are still being marked and edited
+    if ends_at > utcnow():
+        raise ArchiveError("The term has not ended yet; archive it once its last day is over.")
+    for term in manifest['terms']:
+        if term['name'] == name:
+            raise ArchiveError(f"Term '{name}' is already archived.")
+        if starts_at < datetime.fromisoformat(term['ends_at']) and datetime.fromisoformat(term['starts_at']) < ends_at:
+            raise ArchiveError(f"The term overlaps the archived term '{term['name']}'.")
+    if db.session.scalar(db.select(Lecture.id).where(Lecture.timestamp < starts_at).limit(1)) is not None:
+        raise ArchiveError("Older lectures are still live; archive the earlier terms first.")
+
+
+def export_term(directory, starts_at, ends_at, chunk_size):
+    # Stream the term's lectures, and the attendance of each chunk of them, into the two files.
+    # Returns the files' manifest entries and {lecture_id: subject_id} of the lectures written.
+    lectures = JsonlWriter(os.path.join(directory, LECTURES_FILE))
+    attendance = JsonlWriter(os.path.join(directory, ATTENDANCE_FILE))
+    exported = {}
+    last_id = 0
+    while True:
+        chunk = db.session.execute(
+            db.select(Lecture.id, Lecture.timestamp, Lecture.subject_id, Lecture.teacher_id, Lecture.batch_id,
+                      Lecture.sequence_number)
+            .where(Lecture.timestamp >= starts_at, Lecture.timestamp < ends_at, Lecture.id > last_id)
+            .order_by(Lecture.id)
+            .limit(chunk_size)
+        ).all()
+        if not chunk:
+            break
+        for lecture in chunk:
+            exported[lecture.id] = lecture.subject_id
+            lectures.write({
+                'id': lecture.id,
+                'timestamp': lecture.timestamp.isoformat(),
+                'subject_id': lecture.subject_id,
+                'teacher_id': lecture.teacher_id,
+                'batch_id': lecture.batch_id,
+                'sequence_number': lecture.sequence_number
+            })
+        for lecture_id, student_id, status in db.session.execute(
+            db.select(Attendance.lecture_id, Attendance.student_id, Attendance.status)
+            .where(Attendance.lecture_id.in_([lecture.id for lecture in chunk]))
+            .order_by(Attendance.lecture_id, Attendance.student_id)
+        ):
+            attendance.write({'lecture_id': lecture_id, 'student_id': student_id, 'status': status})
+        last_id = chunk[-1].id
+    return lectures.close(), attendance.close(), exported
+
+
+def archive_term(directory, name, starts_at, ends_at, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Move the lectures with starts_at <= timestamp < ends_at (UTC) and their attendance to the archive.
+
+    start and end are the term's calendar dates, recorded in the manifest for people to read.
+    Returns the manifest entry of the term.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    check_term(manifest, name, starts_at, ends_at)
+
+    term_directory = os.path.join(directory, name)
+    if os.path.exists(term_directory):
+        raise ArchiveError(f"{term_directory} already exists but is not in the manifest; move it out of the way.")
+    os.makedirs(term_directory)
+
+    lectures, attendance, exported = export_term(term_directory, starts_at, ends_at, chunk_size)
+
+    # Only the lectures that were written out are deleted, whatever was added to the term meanwhile.
+    # They leave the summary counters but stay in the daily rollups behind the trends, and are
+    # counted per subject to keep the numbering.
+    for subject_id, count in Counter(exported.values()).items():
+        db.session.execute(
+            db.update(Subject)
+            .where(Subject.id == subject_id)
+            .values(archived_lectures=Subject.archived_lectures + count)
+        )
+    lecture_ids = list(exported)
+    for start_index in range(0, len(lecture_ids), chunk_size):
+        chunk = lecture_ids[start_index:start_index + chunk_size]
+        AttendanceStats.forget_lectures(chunk, keep_rollups=True)
+        db.session.execute(
+            db.delete(Attendance).where(Attendance.lecture_id.in_(chunk)).execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            db.delete(Lecture).where(Lecture.id.in_(chunk)).execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+
+    entry = {
+        'name': name,
+        'start': start.isoformat() if start else None,
+        'end': end.isoformat() if end else None,
+        'starts_at': starts_at.isoformat(),
+        'ends_at': ends_at.isoformat(),
+        'archived_at': utcnow().isoformat(),
+        'lectures': lectures,
+        'attendance': attendance
+    }
+    manifest['terms'].append(entry)
+    manifest['terms'].sort(key=lambda term: term['starts_at'])
+    save_manifest(directory, manifest)
+    return entry
+
+
+def archived_until(directory):
+    """End (UTC) of the latest archived term; None when no term is archived."""
+    terms = archived_terms(directory)
+    return max(datetime.fromisoformat(term['ends_at']) for term in terms) if terms else None
+
+
+def archived_terms(directory, starts_at=None, ends_at=None):
+    """Manifest entries of the archived terms overlapping [starts_at, ends_at), oldest first."""
+    if not directory:
+        return []
+    return [
+        term for term in load_manifest(directory)['terms']
+        if (starts_at is None or starts_at < datetime.fromisoformat(term['ends_at'])) and
+        (ends_at is None or datetime.fromisoformat(term['starts_at']) < ends_at)
+    ]
+
+
+def load_register(directory, batch_id, subject_id, starts_at=None, ends_at=None):
+    """Archived lectures of a batch and subject in a time range and their marks.
+
+    Returns ([(key, timestamp, sequence_number)] in timestamp order, {student_id: {key: status}}), where a
+    lecture's key is (term name, lecture id): ids of different terms may repeat after old rows are gone.
+    """
+    lectures, marks = [], {}
+    for term in archived_terms(directory, starts_at, ends_at):
+        term_directory = os.path.join(directory, term['name'])
+        found = []
+        for lecture in read_jsonl(os.path.join(term_directory, term['lectures']['file'])):
+            timestamp = datetime.fromisoformat(lecture['timestamp'])
+            if (lecture['batch_id'] == batch_id and lecture['subject_id'] == subject_id and
+                    (starts_at is None or timestamp >= starts_at) and (ends_at is None or timestamp < ends_at)):
+                found.append(((term['name'], lecture['id']), timestamp, lecture['sequence_number']))
+        if not found:
+            continue
+
+        keys = {lecture[0] for lecture in found}
+        for record in read_jsonl(os.path.join(term_directory, term['attendance']['file'])):
+            key = (term['name'], record['lecture_id'])
+            if key in keys:
+                marks.setdefault(record['student_id'], {})[key] = record['status']
+        lectures.extend(sorted(found, key=lambda lecture: (lecture[1], lecture[0][1])))
+    return lectures, marks
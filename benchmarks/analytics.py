@@ -0,0 +1,79 @@
+"""Time the NumPy attendance analytics against computing the same metrics one student at a time.
+
+    python benchmarks/analytics.py --students 1000 --lectures 200
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics
+from flask import Flask
+from batch_report import seed
+from models import db, Student, Lecture, Attendance
+
+THRESHOLD = 75
+LAST = 10
+
+
+def per_student_metrics(batch_id, subject_id):
+    # One query per student, in the style of AttendanceStats.get_percentage
+    metrics = []
+    for student in Student.query.filter_by(batch_id=batch_id).order_by(Student.enrollment_number).all():
+        statuses = db.session.scalars(
+            db.select(Attendance.status)
+            .join(Lecture, Lecture.id == Attendance.lecture_id)
+            .where(Attendance.student_id == student.id, Lecture.subject_id == subject_id)
+            .order_by(Lecture.timestamp)
+        ).all()
+
+        attended, total = sum(statuses), len(statuses)
+        recent = statuses[-LAST:]
+        streak = longest = 0
+        for status in statuses:
+            streak = 0 if status else streak + 1
+            longest = max(longest, streak)
+        ratio = THRESHOLD / 100
+        metrics.append({
+            'percentage': 100 * attended / total if total else 0,
+            'recent_percentage': 100 * sum(recent) / len(recent) if recent else 0,
+            'longest_absence_streak': longest,
+            'lectures_to_recover': max(0, math.ceil((ratio * total - attended) / (1 - ratio)))
+        })
+    return metrics
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--lectures', type=int, default=200)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        batch_id, subject_id = seed(args.students, args.lectures)
+
+        matrix, load_ms = timed(lambda: analytics.load_matrix(batch_id, subject_id))
+        _, metrics_ms = timed(lambda: analytics.student_metrics(matrix, THRESHOLD, LAST, len(matrix.lectures) // 2))
+        _, per_student_ms = timed(lambda: per_student_metrics(batch_id, subject_id))
+
+        print(f"{args.students} students x {args.lectures} lectures")
+        print(f"  load matrix (3 queries):      {load_ms:10.1f} ms")
+        print(f"  vectorised metrics:           {metrics_ms:10.1f} ms")
+        print(f"  per-student queries + Python: {per_student_ms:10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Compare the row-per-student attendance layout with per-lecture bitmaps.
+
+Seeds an in-memory SQLite database per batch size, converts it to bitmaps and reports the space
+taken by each layout (table plus indexes, from SQLite's dbstat) and the time to load the batch's
+attendance matrix and compute every student's percentage from each:
+
+    python benchmarks/attendance_bitmaps.py --students 60 500 --lectures 400
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics
+from flask import Flask
+from batch_report import seed
+from models import db, Student, Attendance, LectureBitmap
+
+
+def table_bytes(table):
+    # Pages of the table and all of its indexes
+    return db.session.execute(db.text(
+        "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+        "(SELECT name FROM sqlite_master WHERE tbl_name = :table)"
+    ), {'table': table}).scalar() or 0
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def report(batch_id, subject_id, bitmaps):
+    return analytics.load_matrix(batch_id, subject_id, bitmaps=bitmaps).percentage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, nargs='+', default=[60, 500])
+    parser.add_argument('--lectures', type=int, default=400)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'students':>10} {'rows (KiB)':>12} {'bitmaps (KiB)':>14} {'rows (ms)':>10} {'bitmaps (ms)':>13}")
+    for student_count in args.students:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            batch_id, subject_id = seed(student_count, args.lectures)
+            Student.assign_batch_indexes()
+            LectureBitmap.rebuild()
+            db.session.commit()
+
+            rows, bitmaps = report(batch_id, subject_id, False), report(batch_id, subject_id, True)
+            assert (rows == bitmaps).all(), "The layouts disagree"
+
+            rows_ms = best_of(lambda: report(batch_id, subject_id, False), args.repeat)
+            bitmaps_ms = best_of(lambda: report(batch_id, subject_id, True), args.repeat)
+            print(f"{student_count:>10} {table_bytes(Attendance.__tablename__) / 1024:>12.0f} "
+                  f"{table_bytes(LectureBitmap.__tablename__) / 1024:>14.0f} {rows_ms:>10.1f} {bitmaps_ms:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
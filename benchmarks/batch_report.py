@@ -0,0 +1,98 @@
+"""Compare the per-student attendance report with AttendanceStats.get_batch_report.
+
+Builds an in-memory SQLite database for each batch size and times both paths:
+
+    python benchmarks/batch_report.py --students 50 500 5000 --lectures 40
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, User, Batch, Student, Subject, Lecture, Attendance, AttendanceStats
+
+
+def seed(student_count, lecture_count):
+    teacher = User(name="Teacher", email="teacher@example.com", password="-")
+    batch = Batch(name="IT26")
+    db.session.add_all([teacher, batch])
+    db.session.flush()
+    subject = Subject(subject_name="Mathematics", teacher_id=teacher.id)
+    db.session.add(subject)
+    db.session.flush()
+
+    db.session.execute(db.insert(Student), [{
+        'student_name': f"Student {i}",
+        'enrollment_number': f"0101IT22{i:04d}",
+        'batch_id': batch.id
+    } for i in range(student_count)])
+    db.session.execute(db.insert(Lecture), [{
+        'subject_id': subject.id,
+        'teacher_id': teacher.id,
+        'batch_id': batch.id,
+        'timestamp': datetime(2024, 1, 1) + timedelta(days=i),
+        'sequence_number': i + 1
+    } for i in range(lecture_count)])
+
+    student_ids = db.session.scalars(db.select(Student.id)).all()
+    lecture_ids = db.session.scalars(db.select(Lecture.id)).all()
+    rng = random.Random(0)
+    db.session.execute(db.insert(Attendance), [{
+        'lecture_id': lecture_id,
+        'student_id': student_id,
+        'status': rng.random() < 0.8
+    } for lecture_id in lecture_ids for student_id in student_ids])
+    AttendanceStats.rebuild_summary()
+    db.session.commit()
+    return batch.id, subject.id
+
+
+def per_student_report(batch_id, subject_id):
+    # The report as /attendance/ built it before get_batch_report existed
+    report = []
+    for student in Student.query.filter_by(batch_id=batch_id).all():
+        report.append({
+            'student_name': student.student_name,
+            'enrollment_number': student.enrollment_number,
+            'percentage': AttendanceStats.get_percentage(student.id, subject_id)
+        })
+    return sorted(report, key=lambda x: x['percentage'], reverse=True)
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--lectures', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'students':>10} {'per-student (ms)':>18} {'batch report (ms)':>18} {'speedup':>8}")
+    for student_count in args.students:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            batch_id, subject_id = seed(student_count, args.lectures)
+
+            slow = best_of(lambda: per_student_report(batch_id, subject_id), args.repeat)
+            fast = best_of(lambda: AttendanceStats.get_batch_report(batch_id, subject_id), args.repeat)
+            print(f"{student_count:>10} {slow * 1000:>18.1f} {fast * 1000:>18.1f} {slow / fast:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
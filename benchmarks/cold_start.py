@@ -0,0 +1,84 @@
+"""Measure the cold start of the app and fail when it exceeds a budget.
+
+Every run is a fresh interpreter, as on a serverless cold start, against a local SQLite database
+that is migrated once beforehand. Reports the import time of `main` from `python -X importtime`
+and the time from the start of the import to the first response of `/`:
+
+    python benchmarks/cold_start.py --runs 5 --import-budget-ms 1000 --first-response-budget-ms 1500
+
+Exits with status 1 when the median of either measurement is over its budget.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MIGRATE = """
+import main, migrations
+with main.app.app_context():
+    migrations.upgrade(echo=lambda message: None)
+"""
+
+FIRST_RESPONSE = """
+import time
+started = time.perf_counter()
+import main
+response = main.app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+def run_python(code, env, *flags):
+    return subprocess.run([sys.executable, *flags, '-c', code], cwd=PROJECT_ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def import_time_ms(env):
+    # The last importtime line is the cumulative time of `main` itself, in microseconds
+    stderr = run_python('import main', env, '-X', 'importtime').stderr
+    line = [line for line in stderr.splitlines() if line.rstrip().endswith('| main')][-1]
+    return int(line.split('|')[1]) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget-ms', type=float, default=1000)
+    parser.add_argument('--first-response-budget-ms', type=float, default=1500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(directory, 'cold_start.db')}",
+            SECRET_KEY='benchmark',
+            MAIL_INTERVAL_SECONDS='0',
+            SWEEP_INTERVAL_MINUTES='0',
+            PYTHONDONTWRITEBYTECODE='1'
+        )
+        run_python(MIGRATE, env)
+
+        imports = [import_time_ms(env) for _ in range(args.runs)]
+        first_responses = [float(run_python(FIRST_RESPONSE, env).stdout) for _ in range(args.runs)]
+
+    results = [
+        ("import main", statistics.median(imports), args.import_budget_ms),
+        ("first response of /", statistics.median(first_responses), args.first_response_budget_ms),
+    ]
+    over_budget = False
+    print(f"Median of {args.runs} cold starts:")
+    for label, value, budget in results:
+        status = "ok" if value <= budget else "OVER BUDGET"
+        over_budget |= value > budget
+        print(f"  {label:<22} {value:8.1f} ms  (budget {budget:.0f} ms)  {status}")
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
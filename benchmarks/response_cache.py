@@ -0,0 +1,67 @@
+"""Requests per second of the cached read routes with the cache off and on.
+
+Seeds an in-memory SQLite database and drives the app through Flask's test client:
+
+    python benchmarks/response_cache.py --students 300 --lectures 100 --requests 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.update(SQLALCHEMY_DATABASE_URI='sqlite://', SECRET_KEY='benchmark', MAIL_INTERVAL_SECONDS='0')
+
+import caching
+from batch_report import seed
+from main import app
+from models import db, Lecture, User
+
+
+def requests_per_second(client, method, url, data, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.open(url, method=method, data=data)
+        assert response.status_code == 200, (url, response.status_code)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--lectures', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        batch_id, subject_id = seed(args.students, args.lectures)
+        lecture_id = db.session.scalar(db.select(db.func.max(Lecture.id)))
+        teacher = db.session.scalar(db.select(User))
+        session_id = f"{teacher.id}:{teacher.session_version or 0}"
+
+    routes = [
+        ('GET', '/', None),
+        ('POST', '/attendance/', {'batch': batch_id, 'subject': subject_id}),
+        ('GET', f'/mark-attendance?lecture_id={lecture_id}', None),
+        ('POST', '/attendance/defaulters', {'batch': batch_id, 'threshold': '75'}),
+    ]
+
+    print(f"{args.students} students x {args.lectures} lectures, {args.requests} requests per route")
+    print(f"  {'route':<40} {'no cache':>10} {'cached':>10}")
+    client = app.test_client()
+    with client.session_transaction() as session:
+        # The seeded teacher has no usable password; the defaulters report needs a login
+        session['_user_id'] = session_id
+        session['_fresh'] = True
+    for method, url, data in routes:
+        caching.cache.backend = caching.NullBackend()
+        uncached = requests_per_second(client, method, url, data, args.requests)
+        caching.cache.backend = caching.MemoryBackend()
+        cached = requests_per_second(client, method, url, data, args.requests)
+        print(f"  {method + ' ' + url:<40} {uncached:8.1f}/s {cached:8.1f}/s")
+
+
+if __name__ == '__main__':
+    main()
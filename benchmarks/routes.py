@@ -0,0 +1,207 @@
+"""Route benchmark suite: latency percentiles, queries and peak memory per route, against a baseline.
+
+Seeds a temporary SQLite database with `demo.seed_demo()`, logs in as a teacher and drives every
+main route through Flask's test client. Response caching is off unless --cache is given, so the
+numbers are those of the work behind each page:
+
+    python benchmarks/routes.py --save benchmarks/baseline.json
+    python benchmarks/routes.py --baseline benchmarks/baseline.json --tolerance 0.25
+
+With --baseline, exits with status 1 when a route's p95 latency or peak memory grew by more than
+the tolerance, or when it issues more queries per request than before. Latency only compares
+between runs on the same machine, so record the baseline where the suite runs.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from instrumentation import count_queries  # Does not import main, which reads the environment
+
+
+def configure_environment(directory, cache):
+    # Read by main at import time
+    os.environ.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(directory, 'routes.db')}",
+        SECRET_KEY='benchmark',
+        MAIL_INTERVAL_SECONDS='0',
+        SWEEP_INTERVAL_MINUTES='0',
+        CACHE_URL='memory' if cache else 'none'
+    )
+
+
+def define_routes(app, db):
+    """(name, method, url, payload(iteration)) of every benchmarked route, for teacher1's first subject."""
+    from main import encode_cursor
+    from models import User, Subject, Lecture, Student
+
+    teacher = db.session.scalar(db.select(User).where(User.email == 'teacher1@example.com'))
+    lecture = db.session.scalar(
+        db.select(Lecture).where(Lecture.teacher_id == teacher.id).order_by(Lecture.timestamp.desc()).limit(1)
+    )
+    subject_id, batch_id = lecture.subject_id, lecture.batch_id
+    student_ids = db.session.scalars(db.select(Student.id).where(Student.batch_id == batch_id)).all()
+    second_page = db.session.scalar(
+        db.select(Lecture).order_by(Lecture.timestamp.desc(), Lecture.id.desc())
+        .offset(app.config['LECTURES_PER_PAGE'] - 1).limit(1)
+    )
+    assert db.session.get(Subject, subject_id).teacher_id == teacher.id
+
+    def marks(iteration):
+        # Alternate half of the class so every submission writes
+        return {'lecture_id': lecture.id, **{
+            f'attendance_{student_id}': 'on' for i, student_id in enumerate(student_ids) if (i + iteration) % 2
+        }}
+
+    def sync(iteration):
+        return {'lectures': [{
+            'key': f'benchmark-{iteration}', 'lecture_id': lecture.id,
+            'present': student_ids[iteration % 2::2], 'absent': student_ids[1 - iteration % 2::2]
+        }]}
+
+    student = db.session.get(Student, student_ids[0])
+    mentees = ','.join(db.session.scalars(db.select(Student.enrollment_number).where(Student.batch_id == batch_id)))
+    report = {'batch': batch_id, 'subject': subject_id}
+    analytics = f'batch_id={batch_id}&subject_id={subject_id}'
+    return [
+        ('home', 'GET', '/', None),
+        ('older lectures', 'GET', f'/older_lectures?before={encode_cursor(second_page)}', None),
+        ('attendance report', 'POST', '/attendance/', lambda i: report),
+        ('defaulters', 'POST', '/attendance/defaulters', lambda i: {'batch': batch_id, 'threshold': '75'}),
+        ('analytics api', 'GET', f'/api/attendance/analytics?{analytics}', None),
+        ('trends api', 'GET', '/api/attendance/trends?period=week', None),
+        ('export csv', 'GET', f'/attendance/export?{analytics}', None),
+        ('mark attendance (view)', 'GET', f'/mark-attendance?lecture_id={lecture.id}', None),
+        ('mark attendance (submit)', 'POST', f'/mark-attendance?lecture_id={lecture.id}', marks),
+        ('sync api', 'POST', '/api/sync', sync),
+        ('student search api', 'GET', f"/api/students/search?q={student.student_name.split()[0][:3]}", None),
+        ('student', 'GET', f'/student/{student.enrollment_number}', None),
+        ('students api', 'GET', f'/api/students/attendance?enrollment_numbers={mentees}', None),
+    ]
+
+
+def call(client, method, url, payload, iteration):
+    data = payload(iteration) if payload else None
+    if url.startswith('/api/') and method == 'POST':
+        response = client.open(url, method=method, json=data)
+    else:
+        response = client.open(url, method=method, data=data)
+    assert response.status_code in (200, 302), (url, response.status_code)
+    response.get_data()  # Consume streamed bodies
+
+
+def measure(client, engine, route, requests, warmup):
+    name, method, url, payload = route
+    for i in range(warmup):
+        call(client, method, url, payload, i)
+
+    latencies, queries = [], []
+    for i in range(warmup, warmup + requests):
+        with count_queries(engine) as stats:
+            start = time.perf_counter()
+            call(client, method, url, payload, i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(stats.count)
+
+    # tracemalloc slows everything down, so memory is measured in a pass of its own
+    tracemalloc.start()
+    for i in range(warmup + requests, warmup + requests + max(3, requests // 10)):
+        tracemalloc.reset_peak()
+        call(client, method, url, payload, i)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'p50_ms': round(percentiles[49], 2),
+        'p95_ms': round(percentiles[94], 2),
+        'p99_ms': round(percentiles[98], 2),
+        'queries': int(statistics.median(queries)),
+        'peak_kib': round(peak / 1024, 1)
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing every regression against the baseline."""
+    regressions = []
+    for name, current in results['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            continue
+        for metric in ('p95_ms', 'peak_kib'):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {current[metric]}")
+        if current['queries'] > previous['queries']:
+            regressions.append(f"{name}: queries {previous['queries']} -> {current['queries']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batches', type=int, default=4)
+    parser.add_argument('--students', type=int, default=60)
+    parser.add_argument('--lectures', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=50, help="Timed requests per route.")
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--cache', action='store_true', help="Keep the response cache on.")
+    parser.add_argument('--save', help="Write the results to this JSON file.")
+    parser.add_argument('--baseline', help="Compare against this JSON file and fail on regressions.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative growth of p95 and memory.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(directory, args.cache)
+        import demo
+        import migrations
+        from main import app
+        from models import db
+
+        app.config['WTF_CSRF_ENABLED'] = False
+        with app.app_context():
+            migrations.upgrade(echo=lambda message: None)
+            demo.seed_demo(args.batches, args.students, args.lectures)
+            routes = define_routes(app, db)
+            engine = db.engine
+
+        client = app.test_client()
+        client.post('/login', data={'email': 'teacher1@example.com', 'password': demo.DEMO_PASSWORD})
+        results = {
+            'settings': {
+                'batches': args.batches, 'students': args.students, 'lectures': args.lectures,
+                'requests': args.requests, 'cache': args.cache, 'python': platform.python_version()
+            },
+            'routes': {route[0]: measure(client, engine, route, args.requests, args.warmup) for route in routes}
+        }
+        with app.app_context():
+            db.engine.dispose()  # Release the database file before the directory goes
+
+    print(f"{'route':<26} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'peak KiB':>9}")
+    for name, result in results['routes'].items():
+        print(f"{name:<26} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['queries']:>8} {result['peak_kib']:>9.0f}")
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"\nRegressed past the {args.tolerance:.0%} tolerance:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Student search latency with and without the search index.
+
+Seeds an in-memory SQLite database with students named from the demo data's name lists, builds
+the FTS5 index and times the first page of a series of type-ahead queries, as typed one key at
+a time, against the index and against the LIKE scan used without it:
+
+    python benchmarks/student_search.py --students 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search
+from flask import Flask
+from demo import BRANCHES, FIRST_NAMES, LAST_NAMES, insert_chunked
+from models import db, Batch, Student
+
+QUERIES = ['ar', 'arj', 'arjun', 'arjun s', 'arjun sh', 'arjun sharma', 'me', 'meera', 'meera n', 'sha', 'pil',
+           '0101', '0101it', '0101it22', '0101it2201', '0101it220153']
+
+
+def seed(student_count, batch_size, rng):
+    batch_names = [f"{BRANCHES[i % len(BRANCHES)]}{22 + i // len(BRANCHES)}"
+                   for i in range(-(-student_count // batch_size))]
+    insert_chunked(Batch, [{'name': name} for name in batch_names])
+    batch_ids = db.session.scalars(db.select(Batch.id).order_by(Batch.id)).all()
+    insert_chunked(Student, [{
+        'student_name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        'enrollment_number': f"0101{batch_names[n // batch_size]}{n % batch_size:04d}",
+        'batch_id': batch_ids[n // batch_size]
+    } for n in range(student_count)])
+    db.session.commit()
+
+
+def time_queries(repeat):
+    timings = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search.search_students(query)
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[query] = samples
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=2500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        seed(args.students, args.batch_size, random.Random(0))
+
+        scan = time_queries(max(1, args.repeat // 5))
+        start = time.perf_counter()
+        assert search.create_index() == 'fts5', "This SQLite build has no FTS5"
+        db.session.commit()
+        build_ms = (time.perf_counter() - start) * 1000
+        indexed = time_queries(args.repeat)
+
+        print(f"{args.students} students; index built in {build_ms:.0f} ms\n")
+        print(f"{'query':<16} {'matches':>8} {'index p50':>10} {'index p95':>10} {'scan p50':>9}")
+        for query in QUERIES:
+            matches = db.session.execute(db.text(
+                f"SELECT count(*) FROM {search.FTS_TABLE} WHERE {search.FTS_TABLE} MATCH :match"
+            ), {'match': search.fts_match(search.query_terms(query))}).scalar()
+            percentiles = statistics.quantiles(indexed[query], n=20, method='inclusive')
+            print(f"{query:<16} {matches:>8} {statistics.median(indexed[query]):>10.2f} {percentiles[18]:>10.2f} "
+                  f"{statistics.median(scan[query]):>9.2f}")
+
+        everything = [sample for samples in indexed.values() for sample in samples]
+        print(f"\nAll indexed lookups: p50 {statistics.median(everything):.2f} ms, "
+              f"p95 {statistics.quantiles(everything, n=20, method='inclusive')[18]:.2f} ms, "
+              f"max {max(everything):.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Institution-wide attendance trends from raw attendance rows and from the daily rollups.
+
+Seeds an in-memory SQLite database with `demo.seed_demo()` covering a year of lectures and times
+a weekly and a monthly series for every batch and subject together, grouped from the
+attendance and lectures tables by IST day, and read from the rollups:
+
+    python benchmarks/trends.py --batches 10 --students 60 --lectures 1250
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import demo
+import trends
+from flask import Flask
+from models import db, Lecture, Attendance, AttendanceRollup
+
+
+def raw_trends(period):
+    # The query the rollups replace: every attendance row joined to its lecture and grouped by day
+    day = db.func.date(Lecture.timestamp, '+330 minutes')
+    rows = db.session.execute(
+        db.select(
+            day.label('day'),
+            db.func.sum(db.case((Attendance.status == True, 1), else_=0)),
+            db.func.count(Attendance.id)
+        ).join(Lecture, Lecture.id == Attendance.lecture_id).group_by(day).order_by(day)
+    ).all()
+    periods = {}
+    for day, present, total in rows:
+        key = trends.period_start(date.fromisoformat(day), period)
+        counts = periods.setdefault(key, [0, 0])
+        counts[0] += present
+        counts[1] += total
+    return [{'start': key, 'present': present, 'total': total} for key, (present, total) in periods.items()]
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batches', type=int, default=10)
+    parser.add_argument('--students', type=int, default=60)
+    parser.add_argument('--lectures', type=int, default=1250, help="Lectures per batch; 1250 is a year of weekdays.")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['ATTENDANCE_STORAGE'] = 'rows'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        created = demo.seed_demo(args.batches, args.students, args.lectures)
+        rollups = db.session.query(AttendanceRollup).count()
+        print(f"{created['attendance']} attendance rows, {rollups} rollup rows\n")
+
+        print(f"{'period':<8} {'points':>7} {'raw (ms)':>10} {'rollups (ms)':>13}")
+        for period in ('week', 'month'):
+            expected = [(point['start'], point['present'], point['total']) for point in raw_trends(period)]
+            actual = [(point['start'], point['present'], point['total']) for point in trends.attendance_trends(period)]
+            assert expected == actual, "The rollups disagree with the attendance rows"
+            raw_ms = best_of(lambda: raw_trends(period), args.repeat)
+            rollup_ms = best_of(lambda: trends.attendance_trends(period), args.repeat)
+            print(f"{period:<8} {len(actual):>7} {raw_ms:>10.1f} {rollup_ms:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
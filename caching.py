@@ -0,0 +1,218 @@
+"""Version-keyed cache for read-heavy pages.
+
+Cached values are never invalidated one by one. Every key includes the current version of the
+scopes it depends on (the lecture feed, a batch, a subject, a lecture, the student roster), and
+write paths bump those versions, so a stale entry can no longer be looked up and simply ages out
+of the backend.
+
+Caching is off unless CACHE_URL names a backend. A Redis server shares entries and versions
+between every process of every instance, so that the bumps of web workers, CLI commands and cron
+jobs are seen by all of them. CACHE_URL=memory keeps a bounded LRU in the process itself, whose
+versions no other process bumps: it is only safe when a single process serves the app and makes
+every write, and otherwise serves stale pages for up to CACHE_TTL_SECONDS.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+ALL = 'all'  # Included in every key; bumping it drops the whole cache
+FEED = 'feed'  # Lectures added, deleted or renumbered
+ROSTER = 'roster'  # Students added or imported
+
+
+def batch_scope(batch_id):
+    return f'batch:{batch_id}'
+
+
+def subject_scope(subject_id):
+    return f'subject:{subject_id}'
+
+
+def lecture_scope(lecture_id):
+    return f'lecture:{lecture_id}'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+class MemoryBackend:
+    shared = False  # Versions bumped by other processes are not seen
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires at or None, value), least recently used first
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def counters(self, names):
+        with self._lock:
+            return [self._counters.get(name, 0) for name in names]
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    shared = True
+
+    def __init__(self, url, prefix='attendance:'):
+        # redis is only needed when the cache is shared between processes
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL points at Redis, but the redis package is not installed.")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def counters(self, names):
+        return [int(value or 0) for value in self.client.mget([f'{self.prefix}v:{name}' for name in names])]
+
+    def incr(self, name):
+        return self.client.incr(f'{self.prefix}v:{name}')
+
+    def size(self):
+        return None
+
+
+class NullBackend:
+    shared = False
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def counters(self, names):
+        return [0] * len(names)
+
+    def incr(self, name):
+        return 0
+
+    def size(self):
+        return 0
+
+
+class Cache:
+    def __init__(self, backend=None, ttl=None):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def key(self, name, args, scopes):
+        scopes = (ALL,) + tuple(scopes)
+        versions = self.backend.counters(scopes)
+        return f"{name}:{':'.join(map(str, args))}@" + ','.join(f'{scope}={version}' for scope, version in zip(scopes, versions))
+
+    def get_or_set(self, name, args, scopes, func, ttl=None):
+        """Return the cached value of `name` for `args`, calling `func()` to compute it on a miss.
+
+        `scopes` are the versions the value depends on; bumping any of them makes the entry unreachable.
+        Versions are read before `func()` runs, so a value computed across a write is stored under
+        the old versions and never served. `ttl` overrides the cache's time to live for this entry.
+        """
+        key = self.key(name, args, scopes)
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits[name] += 1
+            return value
+
+        self.misses[name] += 1
+        value = func()
+        if value is not None:
+            self.backend.set(key, value, ttl or self.ttl)
+        return value
+
+    def bump(self, *scopes):
+        for scope in scopes:
+            self.backend.incr(scope)
+
+    def clear(self):
+        self.bump(ALL)
+
+    def stats(self):
+        names = sorted(self.hits.keys() | self.misses.keys())
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': self.backend.size(),
+            'hits': sum(self.hits.values()),
+            'misses': sum(self.misses.values()),
+            'by_name': {
+                name: {
+                    'hits': self.hits[name],
+                    'misses': self.misses[name],
+                    'hit_ratio': round(self.hits[name] / ((self.hits[name] + self.misses[name]) or 1), 3)
+                } for name in names
+            }
+        }
+
+
+cache = Cache()
+
+
+def cached(name, args, scopes, func, ttl=None):
+    return cache.get_or_set(name, args, scopes, func, ttl)
+
+
+def init_app(app):
+    """Pick the backend from CACHE_URL: a redis:// URL, 'memory' for the in-process LRU, or empty or 'none'."""
+    url = app.config.get('CACHE_URL') or 'none'
+    ttl = app.config.get('CACHE_TTL_SECONDS') or None
+    if url == 'none':
+        cache.backend = NullBackend()
+    elif url == 'memory':
+        cache.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', 1024))
+    elif url.startswith(('redis://', 'rediss://', 'unix://')):
+        cache.backend = RedisBackend(url)
+    else:
+        raise RuntimeError(f"CACHE_URL must be a redis:// URL, 'memory' or 'none', not {url!r}.")
+    cache.ttl = ttl
+    return cache
+
+
+# Write paths call these after committing
+
+def attendance_changed(lecture):
+    cache.bump(lecture_scope(lecture.id), batch_scope(lecture.batch_id), subject_scope(lecture.subject_id))
+
+
+def lectures_changed(batch_id, subject_id):
+    # Adding or deleting a lecture renumbers its subject and changes the feed
+    cache.bump(FEED, batch_scope(batch_id), subject_scope(subject_id))
+
+
+def roster_changed(batch_id=None):
+    cache.bump(ROSTER, *([batch_scope(batch_id)] if batch_id is not None else []))
@@ -0,0 +1,112 @@
+"""HTTP conditional requests for the feed, report and marking views.
+
+A view's validator is the latest `updated_at` and the row count of every scope the view reads
+(a lecture's attendance and its batch's students for a marking sheet; ...), fetched with one
+UNION ALL query. The count catches deletions, which leave no timestamp behind. Feed pages are
+validated by the lectures of the page alone, so that the check costs the same however long the
+lecture history is. When the client's `If-None-Match` (or, without an ETag, `If-Modified-Since`)
+matches, the view is answered with 304 Not Modified without being run.
+"""
+import hashlib
+import time
+from datetime import timezone
+from functools import wraps
+from flask import Response, current_app, make_response, request, session
+from flask_login import current_user
+from models import db, Student, Lecture, Attendance
+
+
+def table_state(model, *conditions):
+    # (latest modification, row count) of the rows of a model matching the conditions
+    return db.select(db.func.max(model.updated_at), db.func.count()).select_from(model).where(*conditions)
+
+
+def feed_state(per_page, before=None, after=None):
+    # The page's lectures and the one past them (which decides the next page's link), walked
+    # through the (timestamp, id) index like the page itself. Their latest updated_at catches
+    # edits and renumbering, their count and id sum lectures added to or deleted from the page.
+    feed_key = db.tuple_(Lecture.timestamp, Lecture.id)
+    page = db.select(Lecture.id, Lecture.updated_at)
+    if after is not None:
+        page = page.where(feed_key > db.tuple_(*after)).order_by(Lecture.timestamp, Lecture.id)
+    else:
+        if before is not None:
+            page = page.where(feed_key < db.tuple_(*before))
+        page = page.order_by(Lecture.timestamp.desc(), Lecture.id.desc())
+    page = page.limit(per_page + 1).subquery()
+    return [db.select(db.func.max(page.c.updated_at), db.func.count(), db.func.coalesce(db.func.sum(page.c.id), 0))]
+
+
+def lecture_state(lecture_id):
+    batch_id = db.select(Lecture.batch_id).where(Lecture.id == lecture_id).scalar_subquery()
+    return [
+        table_state(Lecture, Lecture.id == lecture_id),
+        table_state(Attendance, Attendance.lecture_id == lecture_id),
+        table_state(Student, Student.batch_id == batch_id)
+    ]
+
+
+def report_state(batch_id, subject_id=None):
+    lectures = [Lecture.batch_id == batch_id]
+    if subject_id is not None:
+        lectures.append(Lecture.subject_id == subject_id)
+    return [
+        table_state(Lecture, *lectures),
+        table_state(Attendance, Attendance.lecture_id.in_(db.select(Lecture.id).where(*lectures))),
+        table_state(Student, Student.batch_id == batch_id)
+    ]
+
+
+def page_identity():
+    # Pages embed the user's menu and, in forms, a CSRF token tied to the session and only valid
+    # for WTF_CSRF_TIME_LIMIT, so a page is not reused across sessions or for more than half of that
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+    return (
+        current_user.get_id(),
+        hashlib.sha1(str(session.get('csrf_token')).encode()).hexdigest(),
+        int(time.time() // (time_limit / 2))
+    )
+
+
+def respond(state, render):
+    """Answer 304 when the client's copy matches `state`, otherwise `render()` it with validators."""
+    rows = db.session.execute(db.union_all(*state)).all()
+    last_modified = max((row[0] for row in rows if row[0] is not None), default=None)
+    etag = hashlib.sha1(repr(([tuple(row) for row in rows], page_identity())).encode()).hexdigest()
+    if last_modified is not None:
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+    # A pending flash message has to be shown, so the page is rendered anyway
+    if '_flashes' not in session:
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = bool(last_modified and request.if_modified_since and
+                                last_modified <= request.if_modified_since)
+        if not_modified:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+    response = make_response(render())
+    if response.status_code == 200:
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True  # Always revalidate
+    return response
+
+
+def conditional_get(state_func):
+    """Serve GET requests of a view conditionally; `state_func` gets the view's arguments."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            return respond(state_func(*args, **kwargs), lambda: view(*args, **kwargs))
+        return wrapper
+    return decorator
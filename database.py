@@ -0,0 +1,156 @@
+"""Engine options, pool metrics and statement timeouts.
+
+Two pool profiles are supported:
+
+- ``queue`` (default): a bounded pool per process for long-running servers, with overflow,
+  recycling of old connections and a liveness check on checkout (pre-ping).
+- ``null``: no pooling in the app, for serverless instances behind PgBouncer in transaction
+  mode; every checkout opens a connection to PgBouncer and closing it hands it back.
+
+Both pools record how long each checkout waited. With DB_STATEMENT_TIMEOUT_MS set, statements
+issued while handling a request are cancelled once they run longer than that: through
+`SET LOCAL statement_timeout` on PostgreSQL and a progress handler on SQLite. The request then
+gets a 503 instead of pinning a connection.
+"""
+import threading
+import time
+from flask import has_request_context, jsonify
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+from models import db
+
+SQLITE_PROGRESS_STEPS = 1000  # SQLite VM instructions between two timeout checks
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0  # Checkouts that gave up after pool_timeout
+        self.statement_timeouts = 0
+        self._lock = threading.Lock()
+
+    def record_wait(self, duration, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total += duration
+            self.wait_max = max(self.wait_max, duration)
+
+    def record_statement_timeout(self):
+        with self._lock:
+            self.statement_timeouts += 1
+
+    def as_dict(self, pool=None):
+        stats = {
+            'checkouts': self.checkouts,
+            'checkout_wait_avg_ms': round(1000 * self.wait_total / self.checkouts, 3) if self.checkouts else 0,
+            'checkout_wait_max_ms': round(1000 * self.wait_max, 3),
+            'checkout_timeouts': self.timeouts,
+            'statement_timeouts': self.statement_timeouts
+        }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        if pool is not None:
+            stats['pool'] = type(pool).__name__
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class TimedPoolMixin:
+    # Times the wait for a connection, including opening a new one when the pool has to
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    pass
+
+
+def engine_options(url, pool='queue', pool_size=5, max_overflow=10, pool_recycle=1800, pool_pre_ping=True,
+                   pool_timeout=30):
+    """SQLALCHEMY_ENGINE_OPTIONS for a pool profile."""
+    url = make_url(url) if url else None
+    if url is None or (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')):
+        return {}  # In-memory SQLite needs Flask-SQLAlchemy's single shared connection
+
+    if pool == 'null':
+        return {'poolclass': TimedNullPool}
+    if pool != 'queue':
+        raise ValueError(f"Unknown DB_POOL '{pool}'; use 'queue' or 'null'.")
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': pool_pre_ping,
+        'pool_timeout': pool_timeout
+    }
+
+
+def is_statement_timeout(error):
+    original = getattr(error, 'orig', None)
+    if getattr(original, 'pgcode', None) == '57014':  # query_canceled
+        return True
+    return 'interrupted' in str(original)  # sqlite3.OperationalError from the progress handler
+
+
+def watch_statement_timeouts(engine, timeout_ms):
+    if engine.dialect.name == 'postgresql':
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(conn):
+            if has_request_context():
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+    elif engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'before_cursor_execute')
+        def start_deadline(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context():
+                deadline = time.perf_counter() + timeout_ms / 1000
+                conn.connection.dbapi_connection.set_progress_handler(
+                    lambda: time.perf_counter() > deadline, SQLITE_PROGRESS_STEPS
+                )
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def clear_deadline(conn, cursor, statement, parameters, context, executemany):
+            conn.connection.dbapi_connection.set_progress_handler(None, SQLITE_PROGRESS_STEPS)
+
+
+def init_app(app):
+    """Enforce DB_STATEMENT_TIMEOUT_MS on the statements of every request."""
+    timeout_ms = app.config.get('DB_STATEMENT_TIMEOUT_MS') or 0
+    if timeout_ms <= 0:
+        return
+
+    with app.app_context():
+        watch_statement_timeouts(db.engine, timeout_ms)
+
+    @app.errorhandler(exc.OperationalError)
+    def statement_timed_out(error):
+        if not is_statement_timeout(error):
+            raise error
+        db.session.rollback()
+        pool_stats.record_statement_timeout()
+        app.logger.warning("Statement timed out after %d ms: %s", timeout_ms, error.statement)
+        return jsonify({"message": "The database took too long to answer; please try again."}), 503
+
+
+def metrics():
+    return pool_stats.as_dict(db.engine.pool)
@@ -0,0 +1,153 @@
+"""Synthetic demo data for development and benchmarks.
+
+`seed_demo()` fills an empty database with teachers, batches, students, subjects, lectures and
+attendance that look like a running term:
+
+- each teacher teaches two subjects, and each batch follows five of them;
+- every batch has five lectures per weekday, ending yesterday, shared out over its subjects;
+- batch sizes vary by about 10% around the requested size;
+- each student has their own attendance rate, drawn from Beta(9, 2) and a little lower in the
+  first slot of the day and on Fridays: about 80% on average, with a tail of students below the
+  75% limit.
+
+The same seed always produces the same data, apart from the dates, which follow today's date.
+"""
+import random
+from datetime import datetime, time, timedelta, timezone
+from werkzeug.security import generate_password_hash
+from models import db, User, Batch, Student, Subject, Lecture, Attendance, AttendanceStats, AttendanceRollup, \
+    LectureBitmap
+
+DEMO_PASSWORD = 'demo1234'
+BRANCHES = ['IT', 'CS', 'EC', 'ME', 'CE', 'EE', 'CH', 'BT', 'AU', 'MT']
+SUBJECTS = [
+    'Mathematics', 'Physics', 'Chemistry', 'Data Structures', 'Algorithms', 'Operating Systems', 'Databases',
+    'Computer Networks', 'Digital Electronics', 'Signals and Systems', 'Thermodynamics', 'Fluid Mechanics',
+    'Engineering Drawing', 'Economics', 'Communication Skills', 'Machine Learning', 'Compilers', 'Statistics'
+]
+FIRST_NAMES = [
+    'Aarav', 'Vivaan', 'Aditya', 'Ananya', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Nikhil', 'Priya', 'Rahul', 'Riya',
+    'Rohan', 'Saanvi', 'Sneha', 'Tanvi', 'Varun', 'Yash', 'Zara', 'Arjun', 'Neha', 'Kabir', 'Pooja', 'Aman'
+]
+LAST_NAMES = [
+    'Sharma', 'Verma', 'Patel', 'Gupta', 'Singh', 'Reddy', 'Iyer', 'Nair', 'Joshi', 'Mehta', 'Kulkarni', 'Das',
+    'Chopra', 'Bose', 'Malhotra', 'Agarwal', 'Rao', 'Khan', 'Mishra', 'Pillai'
+]
+SUBJECTS_PER_BATCH = 5
+LECTURE_SLOTS = [time(9), time(10), time(11), time(13), time(14)]  # IST
+IST_OFFSET = timedelta(hours=5, minutes=30)
+INSERT_CHUNK_SIZE = 10000
+
+
+class DemoError(ValueError):
+    pass
+
+
+def teaching_days(count, today):
+    # The last `count` weekdays before today, oldest first
+    days, day = [], today
+    while len(days) < count:
+        day -= timedelta(days=1)
+        if day.weekday() < 5:
+            days.append(day)
+    return days[::-1]
+
+
+def insert_chunked(model, rows):
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + INSERT_CHUNK_SIZE])
+
+
+def seed_demo(batches=20, students=120, lectures=400, seed=0):
+    """Populate an empty database; returns the number of rows created per table."""
+    if db.session.scalar(db.select(Batch.id).limit(1)) is not None:
+        raise DemoError("The database already has batches; seed an empty database.")
+    if batches > len(BRANCHES) * 4:
+        raise DemoError(f"At most {len(BRANCHES) * 4} batches can be generated.")
+    rng = random.Random(seed)
+    password = generate_password_hash(DEMO_PASSWORD, 'pbkdf2:sha256', 8)  # Hashed once for every account
+
+    teacher_count = max(1, len(SUBJECTS) // 2)
+    users = [{'name': 'Demo Admin', 'email': 'admin@example.com', 'password': password, 'is_admin': True}]
+    users += [{
+        'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        'email': f"teacher{i + 1}@example.com",
+        'password': password,
+        'is_admin': False
+    } for i in range(teacher_count)]
+    insert_chunked(User, users)
+    teacher_ids = db.session.scalars(db.select(User.id).where(User.is_admin == False).order_by(User.id)).all()
+
+    insert_chunked(Subject, [
+        {'subject_name': name, 'teacher_id': teacher_ids[i // 2 % len(teacher_ids)]}
+        for i, name in enumerate(SUBJECTS)
+    ])
+    subjects = db.session.execute(db.select(Subject.id, Subject.teacher_id).order_by(Subject.id)).all()
+
+    # Batches are branch and admission year pairs, named like IT22
+    batch_names = [f"{BRANCHES[i % len(BRANCHES)]}{22 + i // len(BRANCHES)}" for i in range(batches)]
+    insert_chunked(Batch, [{'name': name} for name in batch_names])
+    batch_ids = db.session.scalars(db.select(Batch.id).order_by(Batch.id)).all()
+
+    student_rows = []
+    for name, batch_id in zip(batch_names, batch_ids):
+        size = max(1, round(rng.gauss(students, students / 10)))
+        student_rows += [{
+            'student_name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'enrollment_number': f"0101{name[:2]}{name[2:]}1{n // 100 % 10}{n % 100:02d}",
+            'batch_id': batch_id
+        } for n in range(size)]
+    insert_chunked(Student, student_rows)
+    Student.assign_batch_indexes()
+    rosters = {}
+    for student_id, batch_id in db.session.execute(
+        db.select(Student.id, Student.batch_id).order_by(Student.id)
+    ):
+        rosters.setdefault(batch_id, []).append(student_id)
+    rates = {student_id: rng.betavariate(9, 2) for roster in rosters.values() for student_id in roster}
+
+    days = teaching_days(-(-lectures // len(LECTURE_SLOTS)), datetime.now(timezone.utc).date())
+    lecture_rows = []
+    for batch_id in batch_ids:
+        followed = rng.sample(subjects, SUBJECTS_PER_BATCH)
+        for n in range(lectures):
+            day, slot = days[n // len(LECTURE_SLOTS)], LECTURE_SLOTS[n % len(LECTURE_SLOTS)]
+            subject_id, teacher_id = rng.choice(followed)
+            lecture_rows.append({
+                'subject_id': subject_id,
+                'teacher_id': teacher_id,
+                'batch_id': batch_id,
+                'timestamp': datetime.combine(day, slot) - IST_OFFSET
+            })
+    insert_chunked(Lecture, lecture_rows)
+    Lecture.renumber()
+
+    attendance_count, rows = 0, []
+    lecture_query = db.select(Lecture.id, Lecture.batch_id, Lecture.timestamp).order_by(Lecture.id)
+    for lecture_id, batch_id, timestamp in db.session.execute(lecture_query).all():
+        local = timestamp + IST_OFFSET
+        factor = (0.93 if local.time() == LECTURE_SLOTS[0] else 1) * (0.95 if local.weekday() == 4 else 1)
+        rows += [{
+            'lecture_id': lecture_id,
+            'student_id': student_id,
+            'status': rng.random() < rates[student_id] * factor
+        } for student_id in rosters.get(batch_id, [])]
+        if len(rows) >= INSERT_CHUNK_SIZE:
+            insert_chunked(Attendance, rows)
+            attendance_count, rows = attendance_count + len(rows), []
+    insert_chunked(Attendance, rows)
+    attendance_count += len(rows)
+
+    AttendanceStats.rebuild_summary()
+    AttendanceRollup.rebuild()
+    if LectureBitmap.enabled():
+        LectureBitmap.rebuild()
+    db.session.commit()
+    return {
+        'users': len(users),
+        'subjects': len(subjects),
+        'batches': len(batch_ids),
+        'students': len(student_rows),
+        'lectures': len(lecture_rows),
+        'attendance': attendance_count
+    }
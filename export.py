@@ -0,0 +1,107 @@
+"""Streaming CSV export of the student x lecture attendance register.
+
+The register is pivoted on the fly: attendance is read with a server-side cursor ordered by
+enrollment number and lecture timestamp, and each student's row is written out as soon as the
+next student starts, so memory use does not grow with the size of the batch or the term.
+
+A date range that starts within an archived term also reads that term's lectures of the batch and
+subject from the archive (see archive.py); they come before the live lectures.
+"""
+import csv
+import io
+from datetime import datetime, time, timedelta
+import archive
+from models import db, Student, Lecture, Attendance
+
+IST_OFFSET = timedelta(hours=5, minutes=30)  # Timestamps are stored in UTC and shown in IST
+FETCH_SIZE = 1000
+ROWS_PER_CHUNK = 50
+
+
+def timestamp_range(start=None, end=None):
+    # start and end are IST calendar dates, both inclusive; returns UTC bounds, the end exclusive
+    return (
+        datetime.combine(start, time()) - IST_OFFSET if start else None,
+        datetime.combine(end + timedelta(days=1), time()) - IST_OFFSET if end else None
+    )
+
+
+def lecture_filter(batch_id, subject_id, start=None, end=None):
+    conditions = [Lecture.batch_id == batch_id, Lecture.subject_id == subject_id]
+    starts_at, ends_at = timestamp_range(start, end)
+    if starts_at:
+        conditions.append(Lecture.timestamp >= starts_at)
+    if ends_at:
+        conditions.append(Lecture.timestamp < ends_at)
+    return conditions
+
+
+def attendance_register_csv(batch_id, subject_id, start=None, end=None, archive_dir=None):
+    """Yield the register of a batch and subject as CSV text chunks."""
+    conditions = lecture_filter(batch_id, subject_id, start, end)
+    # Without a start date the register covers the live lectures only
+    archived, archived_marks = [], {}
+    if start and archive_dir:
+        archived, archived_marks = archive.load_register(archive_dir, batch_id, subject_id, *timestamp_range(start, end))
+    live = db.session.execute(
+        db.select(Lecture.id, Lecture.timestamp, Lecture.sequence_number)
+        .where(*conditions)
+        .order_by(Lecture.timestamp, Lecture.id)
+    ).all()
+    lectures = archived + live
+    archived_columns = {lecture[0]: index for index, lecture in enumerate(archived)}
+    columns = {lecture.id: len(archived) + index for index, lecture in enumerate(live)}
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return chunk
+
+    writer.writerow(
+        ['Enrollment Number', 'Student Name'] +
+        [f"Lecture {sequence_number} ({(timestamp + IST_OFFSET):%Y-%m-%d %H:%M})" for _, timestamp, sequence_number in lectures] +
+        ['Attended', 'Total']
+    )
+    yield flush()
+
+    # Only the lectures that have a column: one added since the header was read is left out
+    marks = db.select(
+        Attendance.student_id, Attendance.lecture_id, Attendance.status, Lecture.timestamp
+    ).join(
+        Lecture, Lecture.id == Attendance.lecture_id
+    ).where(*conditions, Attendance.lecture_id.in_(list(columns))).subquery()
+
+    rows = db.session.execute(
+        db.select(Student.id, Student.enrollment_number, Student.student_name, marks.c.lecture_id, marks.c.status)
+        .outerjoin(marks, marks.c.student_id == Student.id)
+        .where(Student.batch_id == batch_id)
+        .order_by(Student.enrollment_number, marks.c.timestamp, marks.c.lecture_id),
+        execution_options={'yield_per': FETCH_SIZE}
+    )
+
+    def write_student(student, cells):
+        attended = cells.count('P')
+        writer.writerow([student.enrollment_number, student.student_name] + cells +
+                        [attended, len(cells) - cells.count('')])
+
+    student, cells, written = None, None, 0
+    for row in rows:
+        if student is None or row.id != student.id:
+            if student is not None:
+                write_student(student, cells)
+                written += 1
+                if written % ROWS_PER_CHUNK == 0:
+                    yield flush()
+            student, cells = row, [''] * len(lectures)
+            for key, status in archived_marks.get(row.id, {}).items():
+                cells[archived_columns[key]] = 'P' if status else 'A'
+        if row.lecture_id is not None:
+            cells[columns[row.lecture_id]] = 'P' if row.status else 'A'
+
+    if student is not None:
+        write_student(student, cells)
+    yield flush()
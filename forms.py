@@ -1,8 +1,16 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SelectField, BooleanField, SubmitField, EmailField
-from wtforms.validators import DataRequired, Length, EqualTo, Regexp
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, SelectField, BooleanField, SubmitField, EmailField, DecimalField
+from wtforms.validators import DataRequired, InputRequired, Length, EqualTo, NumberRange, Regexp
 from wtforms.fields import HiddenField
 
+# Shared by StudentForm and the bulk roster import
+STUDENT_NAME_LENGTH = (2, 100)
+ENROLLMENT_NUMBER_LENGTH = 12
+ENROLLMENT_NUMBER_PATTERN = r'^\d{4}[A-Z]{2}\d{3}[A-Z0-9]\d{2}$'
+ENROLLMENT_NUMBER_MESSAGE = "Enrollment number must follow the pattern: 4 digits, 2 letters, 3 digits, " \
+                            "1 alphanumeric, and 2 digits. Eg: 0101IT221076"
+
 
 # User Registration Form (for Admin to register Teachers)
 class UserRegistrationForm(FlaskForm):
@@ -28,22 +36,28 @@ class SubjectForm(FlaskForm):
 
 # Student Creation Form
 class StudentForm(FlaskForm):
-    student_name = StringField('Student Name', validators=[DataRequired(), Length(min=2, max=100)])
+    student_name = StringField('Student Name', validators=[
+        DataRequired(), Length(min=STUDENT_NAME_LENGTH[0], max=STUDENT_NAME_LENGTH[1])
+    ])
     enrollment_number = StringField(
         'Enrollment Number',
         validators=[
             DataRequired(),
-            Length(min=12, max=12),  # Length validation for enrollment numbers
-            Regexp(
-                r'^\d{4}[A-Z]{2}\d{3}[A-Z0-9]\d{2}$',
-                message="Enrollment number must follow the pattern: 4 digits, 2 letters, 3 digits, 1 alphanumeric, and 2 digits. Eg: 0101IT221076"
-            )
+            Length(min=ENROLLMENT_NUMBER_LENGTH, max=ENROLLMENT_NUMBER_LENGTH),  # Length validation for enrollment numbers
+            Regexp(ENROLLMENT_NUMBER_PATTERN, message=ENROLLMENT_NUMBER_MESSAGE)
         ]
     )
     batch = SelectField('Batch', coerce=int, validators=[DataRequired()])  # Batch choices to be populated dynamically
     submit = SubmitField('Create Student')
 
 
+# Bulk Student Import Form
+class StudentImportForm(FlaskForm):
+    roster = FileField('Roster (CSV or XLSX with student_name, enrollment_number and optional batch columns)',
+                       validators=[FileRequired(), FileAllowed(['csv', 'xlsx'], "Upload a .csv or .xlsx file.")])
+    batch = SelectField('Default Batch', coerce=int, validators=[DataRequired()])  # Used when a row has no batch
+    submit = SubmitField('Import Students')
+
 
 # Lecture Selection Form (Formerly SelectSubjectBatchForm)
 class LectureForm(FlaskForm):
@@ -88,3 +102,10 @@ class AttendanceReportForm(FlaskForm):
     subject = SelectField('Subject', coerce=int, validators=[DataRequired()])  # Populated dynamically
     batch = SelectField('Batch', coerce=int, validators=[DataRequired()])  # Populated dynamically
     submit = SubmitField('View Attendance Report')
+
+
+# Defaulter Report Form
+class DefaulterReportForm(FlaskForm):
+    batch = SelectField('Batch', coerce=int, validators=[DataRequired()])  # Populated dynamically
+    threshold = DecimalField('Minimum Attendance (%)', places=2, validators=[InputRequired(), NumberRange(min=0, max=100)])
+    submit = SubmitField('View Defaulters')
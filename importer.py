@@ -0,0 +1,132 @@
+"""Bulk student roster import.
+
+Rows are streamed from a CSV or XLSX file and handled in chunks: each chunk is validated with
+the same rules as StudentForm, checked for existing enrollment numbers with one query and
+inserted with one executemany, so the file is never held in memory as a whole.
+"""
+import csv
+import io
+import re
+from itertools import islice
+from forms import STUDENT_NAME_LENGTH, ENROLLMENT_NUMBER_LENGTH, ENROLLMENT_NUMBER_PATTERN, ENROLLMENT_NUMBER_MESSAGE
+from models import db, Batch, Student, lock_rows
+
+CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+
+enrollment_number_re = re.compile(ENROLLMENT_NUMBER_PATTERN)
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []  # (line, enrollment number, message), capped at MAX_REPORTED_ERRORS
+
+    def reject(self, line, enrollment_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, enrollment_number, message))
+
+
+def read_csv(stream):
+    # Yields (line, row) pairs; the header is line 1
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_xlsx(stream):
+    # openpyxl is only needed for spreadsheet uploads
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("XLSX import needs the openpyxl package; upload a CSV file instead.")
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        for line, values in enumerate(rows, start=2):
+            yield line, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def read_roster(stream, filename):
+    if filename.lower().endswith('.xlsx'):
+        return read_xlsx(stream)
+    return read_csv(stream)
+
+
+def clean(value):
+    return str(value).strip() if value is not None else ''
+
+
+def validate_row(row, batch_ids, default_batch_id):
+    # Returns (student values, None) or (None, error message)
+    student_name = clean(row.get('student_name'))
+    enrollment_number = clean(row.get('enrollment_number'))
+    batch_name = clean(row.get('batch'))
+
+    if not STUDENT_NAME_LENGTH[0] <= len(student_name) <= STUDENT_NAME_LENGTH[1]:
+        return None, f"Student name must be between {STUDENT_NAME_LENGTH[0]} and {STUDENT_NAME_LENGTH[1]} characters."
+    if len(enrollment_number) != ENROLLMENT_NUMBER_LENGTH or not enrollment_number_re.match(enrollment_number):
+        return None, ENROLLMENT_NUMBER_MESSAGE
+
+    batch_id = batch_ids.get(batch_name) if batch_name else default_batch_id
+    if batch_id is None:
+        return None, f"Batch '{batch_name}' does not exist." if batch_name else "No batch given."
+
+    return {'student_name': student_name, 'enrollment_number': enrollment_number, 'batch_id': batch_id}, None
+
+
+def import_chunk(chunk, batch_ids, default_batch_id, seen, report):
+    valid = []
+    for line, row in chunk:
+        student, error = validate_row(row, batch_ids, default_batch_id)
+        if error:
+            report.reject(line, clean(row.get('enrollment_number')), error)
+        elif student['enrollment_number'] in seen:
+            report.reject(line, student['enrollment_number'], "Duplicate enrollment number in this file.")
+        else:
+            seen.add(student['enrollment_number'])
+            valid.append((line, student))
+
+    # One lookup for every enrollment number of the chunk
+    existing = set(db.session.scalars(
+        db.select(Student.enrollment_number).where(
+            Student.enrollment_number.in_([student['enrollment_number'] for _, student in valid])
+        )
+    )) if valid else set()
+
+    students = []
+    for line, student in valid:
+        if student['enrollment_number'] in existing:
+            report.reject(line, student['enrollment_number'], "A student with this enrollment number already exists.")
+        else:
+            students.append(student)
+
+    if students:
+        lock_rows(Batch, [student['batch_id'] for student in students])  # See Student.next_batch_index
+        db.session.execute(db.insert(Student), students)
+        Student.assign_batch_indexes()
+    db.session.commit()
+    report.imported += len(students)
+
+
+def import_students(rows, default_batch_id=None, chunk_size=CHUNK_SIZE):
+    """Import (line, row) pairs with student_name, enrollment_number and optional batch keys."""
+    batch_ids = {batch.name: batch.id for batch in Batch.query.all()}
+    seen = set()  # Enrollment numbers already taken by earlier rows of the file
+    report = ImportReport()
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        import_chunk(chunk, batch_ids, default_batch_id, seen, report)
+
+    report.errors.sort(key=lambda error: error[0])
+    return report
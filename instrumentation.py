@@ -0,0 +1,141 @@
+"""Opt-in SQL instrumentation built on SQLAlchemy engine events.
+
+When enabled with `init_app(app)`, every request counts its statements and their total time,
+reports them in a `Server-Timing` header and logs its slowest statements together with the line
+of application code that issued them. `count_queries()` and `assert_max_queries()` use the same
+hooks to check query counts in tests and benchmarks.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from flask import g
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+_local = threading.local()
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []  # (duration, statement, call site)
+
+    def record(self, duration, statement, call_site):
+        self.count += 1
+        self.duration += duration
+        self.statements.append((duration, statement, call_site))
+
+    def slowest(self, limit):
+        return sorted(self.statements, key=lambda entry: entry[0], reverse=True)[:limit]
+
+
+def _collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+def _call_site():
+    # The innermost frame of application code, skipping this module and installed packages
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_ROOT) and filename != __file__ and 'site-packages' not in filename:
+            return f"{os.path.relpath(filename, PROJECT_ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "<unknown>"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _collectors():
+        context._query_started = time.perf_counter()
+        context._query_call_site = _call_site()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _collectors()
+    if collectors and hasattr(context, '_query_started'):
+        duration = time.perf_counter() - context._query_started
+        for stats in collectors:
+            stats.record(duration, statement, context._query_call_site)
+
+
+def watch_engine(engine):
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Collect the statements executed inside the block."""
+    if engine is None:
+        from models import db
+        engine = db.engine
+    watch_engine(engine)
+
+    stats = QueryStats()
+    _collectors().append(stats)
+    try:
+        yield stats
+    finally:
+        _collectors().remove(stats)
+
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """Fail if the block executes more than `limit` statements, e.g. for a route:
+
+        with assert_max_queries(4):
+            client.get('/')
+    """
+    with count_queries(engine) as stats:
+        yield stats
+    if stats.count > limit:
+        statements = "\n".join(f"  {call_site}: {statement}" for _, statement, call_site in stats.statements)
+        raise AssertionError(f"Expected at most {limit} queries, {stats.count} were executed:\n{statements}")
+
+
+def init_app(app):
+    """Count and time the statements of every request of the app."""
+    slow_threshold = app.config.get('SQL_SLOW_QUERY_MS', 100) / 1000
+    log_slowest = app.config.get('SQL_LOG_SLOWEST', 3)
+
+    with app.app_context():
+        from models import db
+        watch_engine(db.engine)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+        g.request_started = time.perf_counter()
+        _collectors().append(g.query_stats)
+
+    @app.after_request
+    def add_server_timing(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        total = time.perf_counter() - g.request_started
+
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries", app;dur={total * 1000:.1f}'
+        )
+        for duration, statement, call_site in stats.slowest(log_slowest):
+            if duration >= slow_threshold:
+                logger.warning("Slow query (%.1f ms) at %s: %s", duration * 1000, call_site, statement)
+        return response
+
+    @app.teardown_request
+    def stop_query_stats(error=None):
+        # after_request is skipped when a view raises, so the collector is released here
+        stats = g.pop('query_stats', None)
+        if stats in _collectors():
+            _collectors().remove(stats)
@@ -0,0 +1,243 @@
+"""Outgoing mail queue.
+
+Messages are written to the mail_outbox table inside the request's transaction and delivered
+later by `deliver_queue()`, from a background thread or the `send-mail-queue` command. A run
+claims due messages in batches, sends every batch over one authenticated SMTP connection and
+retries failures with exponential backoff until MAIL_MAX_ATTEMPTS is reached.
+
+Any SMTP server works, including a local stand-in for development:
+
+    python -m aiosmtpd -n -l localhost:8025    # MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_USE_TLS=0
+"""
+import logging
+import smtplib
+import threading
+from datetime import timedelta
+from email.message import EmailMessage
+from flask import current_app
+from models import db, User, Student, Subject, AttendanceSummary, OutboxMessage, utcnow
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF = timedelta(hours=1)
+CLAIM_LEASE = timedelta(minutes=10)  # A claimed message is retried if its worker dies before finishing
+
+_wakeup = threading.Event()
+
+
+def build_message(sender, recipient, subject, body, reply_to=None):
+    # Raises ValueError for malformed headers, e.g. addresses containing line breaks
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient
+    if reply_to:
+        message['Reply-To'] = reply_to
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
+
+
+def enqueue(recipient, subject, body, sender=None, reply_to=None):
+    """Add a message to the outbox; it is sent once the caller commits."""
+    return enqueue_many([{'recipient': recipient, 'subject': subject, 'body': body, 'reply_to': reply_to}],
+                        sender=sender)
+
+
+def enqueue_many(messages, sender=None):
+    """Add dicts with recipient, subject, body and optional reply_to keys to the outbox in one insert."""
+    sender = sender or current_app.config['MAIL_SENDER']
+    now = utcnow()
+    rows = []
+    for message in messages:
+        build_message(sender, message['recipient'], message['subject'], message['body'], message.get('reply_to'))
+        rows.append({
+            'sender': sender,
+            'recipient': message['recipient'],
+            'reply_to': message.get('reply_to'),
+            'subject': message['subject'],
+            'body': message['body'],
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'created_at': now
+        })
+    if rows:
+        db.session.execute(db.insert(OutboxMessage), rows)
+    return len(rows)
+
+
+def wake_worker():
+    # Let the background worker deliver new messages without waiting for its next interval
+    _wakeup.set()
+
+
+def claim_due_messages(batch_size):
+    # Claim due messages by pushing their next attempt past the lease, in one statement, so
+    # concurrent workers never send the same message (FOR UPDATE SKIP LOCKED on PostgreSQL)
+    now = utcnow()
+    due = db.select(OutboxMessage.id).where(
+        OutboxMessage.status == 'pending',
+        OutboxMessage.next_attempt_at <= now
+    ).order_by(OutboxMessage.id).limit(batch_size).with_for_update(skip_locked=True)
+
+    claimed = db.session.execute(
+        db.update(OutboxMessage)
+        .where(OutboxMessage.id.in_(due))
+        .values(next_attempt_at=now + CLAIM_LEASE, attempts=OutboxMessage.attempts + 1)
+        .returning(OutboxMessage.id, OutboxMessage.sender, OutboxMessage.recipient, OutboxMessage.reply_to,
+                   OutboxMessage.subject, OutboxMessage.body, OutboxMessage.attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return sorted(claimed, key=lambda message: message.id)
+
+
+def open_connection(config):
+    connection = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT'])
+    try:
+        if config['MAIL_USE_TLS']:
+            connection.starttls()
+        if config['MAIL_USERNAME']:
+            connection.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+    except Exception:
+        connection.close()
+        raise
+    return connection
+
+
+def close_connection(connection):
+    try:
+        connection.quit()
+    except smtplib.SMTPException:
+        connection.close()
+    except OSError:
+        pass
+
+
+def is_permanent(error):
+    # 5xx replies and refused recipients will not succeed on a retry
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def failure(message, error, config, permanent=False):
+    # The update that records a failed attempt: a retry after a backoff, or a final failure
+    update = {'id': message.id, 'last_error': str(error)[:500]}
+    if permanent or message.attempts >= config['MAIL_MAX_ATTEMPTS']:
+        update['status'] = 'failed'
+    else:
+        delay = min(timedelta(seconds=config['MAIL_RETRY_SECONDS'] * 2 ** (message.attempts - 1)), MAX_BACKOFF)
+        update['next_attempt_at'] = utcnow() + delay
+    return update
+
+
+def send_batch(connection, messages, config):
+    # Returns the connection (None once it is lost) and the per-message outbox updates
+    updates = []
+    for index, message in enumerate(messages):
+        try:
+            if connection is None:
+                connection = open_connection(config)
+            connection.send_message(build_message(
+                message.sender, message.recipient, message.subject, message.body, message.reply_to
+            ))
+            updates.append({'id': message.id, 'status': 'sent', 'sent_at': utcnow(), 'last_error': None})
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError, ValueError) as error:
+            # The server rejected this message only; carry on with the rest of the batch
+            logger.warning("Could not send mail %d to %s: %s", message.id, message.recipient, error)
+            updates.append(failure(message, error, config, permanent=is_permanent(error) or isinstance(error, ValueError)))
+        except OSError as error:
+            # Includes every other SMTPException: the server is unreachable, refused the login or
+            # dropped the connection, so this and the rest of the batch are retried later
+            logger.warning("SMTP connection failed: %s", error)
+            updates.extend(failure(pending, error, config) for pending in messages[index:])
+            if connection is not None:
+                connection.close()
+            return None, updates
+    return connection, updates
+
+
+def deliver_queue(batch_size=None):
+    """Send every due message, reusing one SMTP connection, and return (sent, failed) counts.
+
+    Messages that failed but will be retried are counted in neither.
+    """
+    config = current_app.config
+    batch_size = batch_size or config['MAIL_BATCH_SIZE']
+    connection = None
+    sent = failed = 0
+    try:
+        while True:
+            messages = claim_due_messages(batch_size)
+            if not messages:
+                break
+
+            connection, updates = send_batch(connection, messages, config)
+            db.session.execute(db.update(OutboxMessage), updates)
+            db.session.commit()
+
+            sent += sum(1 for update in updates if update.get('status') == 'sent')
+            failed += sum(1 for update in updates if update.get('status') == 'failed')
+            if connection is None:
+                break  # The server is unreachable; everything left stays queued for a later run
+    finally:
+        if connection is not None:
+            close_connection(connection)
+    return sent, failed
+
+
+def low_attendance_alerts(batch_id, threshold):
+    """One digest per subject, for its teacher, listing the students of the batch below the threshold."""
+    rows = db.session.execute(
+        db.select(
+            Subject.id, Subject.subject_name, User.email, Student.student_name, Student.enrollment_number,
+            AttendanceSummary.attended, AttendanceSummary.total
+        ).join(
+            Student, Student.id == AttendanceSummary.student_id
+        ).join(
+            Subject, Subject.id == AttendanceSummary.subject_id
+        ).join(
+            User, User.id == Subject.teacher_id
+        ).where(
+            Student.batch_id == batch_id,
+            AttendanceSummary.total > 0,
+            100 * AttendanceSummary.attended < threshold * AttendanceSummary.total
+        ).order_by(Subject.id, Student.enrollment_number)
+    ).all()
+
+    digests = {}
+    for row in rows:
+        digest = digests.setdefault(row.id, {'subject': row.subject_name, 'recipient': row.email, 'lines': []})
+        digest['lines'].append(
+            f"{row.enrollment_number}  {row.student_name}: {row.attended}/{row.total} "
+            f"({100 * row.attended / row.total:.2f}%)"
+        )
+
+    return [{
+        'recipient': digest['recipient'],
+        'subject': f"Low attendance in {digest['subject']}",
+        'body': f"{len(digest['lines'])} students are below {threshold:g}% attendance in {digest['subject']}:\n\n" +
+                "\n".join(digest['lines'])
+    } for digest in digests.values()]
+
+
+def start_mail_worker(app, interval, batch_size):
+    """Deliver the queue every `interval`, or as soon as `wake_worker()` is called, on a daemon thread."""
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.is_set():
+            _wakeup.wait(interval.total_seconds())
+            _wakeup.clear()
+            with app.app_context():
+                try:
+                    sent, failed = deliver_queue(batch_size)
+                    if sent or failed:
+                        logger.info("Sent %d queued messages, %d failed permanently.", sent, failed)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Mail queue delivery failed.")
+
+    threading.Thread(target=run, name='mail-worker', daemon=True).start()
+    return stopped
@@ -1,25 +1,101 @@
 import os
-import smtplib
+import time
+import click
 from functools import wraps
-from dotenv import load_dotenv
 from flask_bootstrap import Bootstrap5
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, User, Batch, Student, Subject, Lecture, Attendance, AttendanceStats
-from flask import Flask, render_template, request, redirect, url_for, jsonify, abort, flash
+import instrumentation
+import importer
+import export
+import archive
+import caching
+import database
+import demo
+import mailer
+import principals
+import reports
+import search
+import student_report
+import sync
+import trends
+from sweeper import sweep_stale_lectures, start_sweeper
+from conditional import conditional_get, feed_state, lecture_state, report_state
+from models import db, User, Batch, Student, Subject, Lecture, Attendance, AttendanceStats, AttendanceRollup, \
+    LectureBitmap
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, abort, flash, \
+    stream_with_context
 from flask_login import login_user, LoginManager, current_user, logout_user, login_required
 from forms import UserRegistrationForm, SubjectForm, StudentForm, LectureForm, AttendanceForm, AttendanceReportForm, \
-    UserLoginForm, BatchForm
+    UserLoginForm, BatchForm, StudentImportForm, DefaulterReportForm
 
-load_dotenv()
+# Deployments get their settings from the environment; python-dotenv is only imported for a local .env file
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+if os.path.exists(ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
 EMAIL = os.getenv("EMAIL")
 PASSWORD = os.getenv("PASSWORD")
 SECRET_KEY = os.getenv("SECRET_KEY")
 SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
+LECTURES_PER_PAGE = int(os.getenv("LECTURES_PER_PAGE", 5))
+STUDENTS_PER_PAGE = int(os.getenv("STUDENTS_PER_PAGE", 20))
+SWEEP_GRACE_MINUTES = int(os.getenv("SWEEP_GRACE_MINUTES", 30))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", 500))
+SWEEP_INTERVAL_MINUTES = int(os.getenv("SWEEP_INTERVAL_MINUTES", 0))
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION", "").lower() in ("1", "true", "yes")
+SQL_SLOW_QUERY_MS = int(os.getenv("SQL_SLOW_QUERY_MS", 100))
+ATTENDANCE_THRESHOLD = float(os.getenv("ATTENDANCE_THRESHOLD", 75))
+RECENT_LECTURES = int(os.getenv("RECENT_LECTURES", 10))
+ATTENDANCE_STORAGE = os.getenv("ATTENDANCE_STORAGE", "rows")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+MAIL_PORT = int(os.getenv("MAIL_PORT", 587))
+MAIL_USE_TLS = os.getenv("MAIL_USE_TLS", "1").lower() in ("1", "true", "yes")
+MAIL_USERNAME = os.getenv("MAIL_USERNAME", EMAIL)
+MAIL_PASSWORD = os.getenv("MAIL_PASSWORD", PASSWORD)
+MAIL_SENDER = os.getenv("MAIL_SENDER", EMAIL)
+MAIL_INTERVAL_SECONDS = int(os.getenv("MAIL_INTERVAL_SECONDS", 0))
+CACHE_URL = os.getenv("CACHE_URL", "")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", 3600))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 300))
+DB_POOL = os.getenv("DB_POOL", "queue")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
+app.config['LECTURES_PER_PAGE'] = LECTURES_PER_PAGE
+app.config['STUDENTS_PER_PAGE'] = STUDENTS_PER_PAGE
+app.config['SWEEP_GRACE_PERIOD'] = timedelta(minutes=SWEEP_GRACE_MINUTES)
+app.config['SWEEP_BATCH_SIZE'] = SWEEP_BATCH_SIZE
+app.config['SQL_SLOW_QUERY_MS'] = SQL_SLOW_QUERY_MS
+app.config['ATTENDANCE_THRESHOLD'] = ATTENDANCE_THRESHOLD
+app.config['RECENT_LECTURES'] = RECENT_LECTURES
+app.config['ATTENDANCE_STORAGE'] = ATTENDANCE_STORAGE
+app.config['ARCHIVE_DIR'] = ARCHIVE_DIR
+app.config['MAIL_SERVER'] = MAIL_SERVER
+app.config['MAIL_PORT'] = MAIL_PORT
+app.config['MAIL_USE_TLS'] = MAIL_USE_TLS
+app.config['MAIL_USERNAME'] = MAIL_USERNAME
+app.config['MAIL_PASSWORD'] = MAIL_PASSWORD
+app.config['MAIL_SENDER'] = MAIL_SENDER
+app.config['MAIL_TIMEOUT'] = 30
+app.config['MAIL_BATCH_SIZE'] = 100
+app.config['MAIL_MAX_ATTEMPTS'] = 8
+app.config['MAIL_RETRY_SECONDS'] = 60
+app.config['CACHE_URL'] = CACHE_URL
+app.config['CACHE_MAX_ENTRIES'] = CACHE_MAX_ENTRIES
+app.config['CACHE_TTL_SECONDS'] = CACHE_TTL_SECONDS
+app.config['USER_CACHE_TTL_SECONDS'] = USER_CACHE_TTL_SECONDS
 Bootstrap5(app)
 
 
@@ -28,11 +104,41 @@ login_manager.init_app(app)
 
 
 app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(
+    SQLALCHEMY_DATABASE_URI, pool=DB_POOL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+    pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING, pool_timeout=DB_POOL_TIMEOUT
+)
+app.config['DB_STATEMENT_TIMEOUT_MS'] = DB_STATEMENT_TIMEOUT_MS
 db.init_app(app)
+database.init_app(app)
 
+# The schema is not touched at import time, which would add reflection round trips to every cold
+# start; create and migrate it once per deployment with `flask --app main upgrade-db`
 
-with app.app_context():
-    db.create_all()
+
+# Version-keyed cache of the feed, reports and attendance sheets
+caching.init_app(app)
+
+# Logged-in users are loaded from the cache rather than with a query per request
+principals.init_app(app)
+
+
+# Per-request query counts and timings in a Server-Timing header
+if SQL_INSTRUMENTATION:
+    instrumentation.init_app(app)
+
+
+# Optionally sweep stale lectures in the background instead of relying on cron
+if SWEEP_INTERVAL_MINUTES > 0:
+    start_sweeper(app, timedelta(minutes=SWEEP_INTERVAL_MINUTES),
+                  app.config['SWEEP_GRACE_PERIOD'], app.config['SWEEP_BATCH_SIZE'])
+
+
+# The mail outbox is delivered by `flask send-mail-queue`, from cron or as a worker process with --watch.
+# A delivery thread in every web process (every gunicorn worker, serverless instance and CLI command
+# that imports main) is opt-in, for single-process deployments.
+if MAIL_INTERVAL_SECONDS > 0:
+    mailer.start_mail_worker(app, timedelta(seconds=MAIL_INTERVAL_SECONDS), app.config['MAIL_BATCH_SIZE'])
 
 
 def admin_only(func):
@@ -61,7 +167,7 @@ def creator_only(func):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    return principals.load(user_id)
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -115,33 +221,48 @@ def logout():
     return redirect(url_for('home'))
 
 
-def render_lectures_template(lectures, start=None, end=None):
-    total_lectures = len(lectures)
-    user = current_user if current_user.is_authenticated else None
-    year = datetime.now().year
+def encode_cursor(lecture):
+    # Keyset cursor for the lecture feed: "<timestamp>_<id>"
+    return f"{lecture.timestamp.isoformat()}_{lecture.id}"
 
-    if start is None:
-        start = 0
-    if end is None:
-        end = total_lectures
 
-    start = max(0, start)
-    end = min(total_lectures, end)
+def decode_cursor(cursor):
+    try:
+        timestamp, lecture_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(lecture_id)
+    except ValueError:
+        return abort(400)
 
-    # Sort lectures by timestamp for proper sequencing
-    lectures_sorted = sorted(lectures, key=lambda l: l.timestamp)
 
-    # Calculate lecture numbers for each subject
-    lecture_numbers = {}
-    for lecture in lectures_sorted:
-        if lecture.subject_id not in lecture_numbers:
-            lecture_numbers[lecture.subject_id] = []
-        lecture_numbers[lecture.subject_id].append(lecture.id)
+def get_lecture_page(before=None, after=None):
+    per_page = app.config['LECTURES_PER_PAGE']
+    feed_key = tuple_(Lecture.timestamp, Lecture.id)
 
-    # Map lecture IDs to their sequence numbers
-    lecture_sequence = {
-        lecture.id: lecture_numbers[lecture.subject_id].index(lecture.id) + 1 for lecture in lectures_sorted
-    }
+    # Walk the (timestamp, id) index from the cursor instead of using OFFSET,
+    # fetching one extra row to know whether another page exists
+    # Subject and teacher are shown on every card, so load them in the same query
+    query = Lecture.query.options(joinedload(Lecture.subject), joinedload(Lecture.teacher))
+    if after is not None:
+        query = query.filter(feed_key > tuple_(*after)).order_by(Lecture.timestamp, Lecture.id)
+    else:
+        if before is not None:
+            query = query.filter(feed_key < tuple_(*before))
+        query = query.order_by(Lecture.timestamp.desc(), Lecture.id.desc())
+
+    lectures = query.limit(per_page + 1).all()
+    has_more = len(lectures) > per_page
+    lectures = lectures[:per_page]
+
+    # Pages fetched towards newer lectures come back oldest-first
+    if after is not None:
+        lectures.reverse()
+
+    return lectures, has_more
+
+
+def render_lectures_template(lectures, has_older=False, has_newer=False):
+    user = current_user if current_user.is_authenticated else None
+    year = datetime.now().year
 
     # Convert UTC timestamp to IST manually and format
     formatted_lectures = []
@@ -162,64 +283,88 @@ def render_lectures_template(lectures, start=None, end=None):
         "index.html",
         year=year,
         lectures=formatted_lectures,  # Pass formatted lectures with original lecture object
-        lecture_sequence=lecture_sequence,  # Pass sequence numbers
-        start=start,
-        end=end,
-        user=user,
-        len=total_lectures
+        older_cursor=encode_cursor(lectures[-1]) if has_older else None,
+        newer_cursor=encode_cursor(lectures[0]) if has_newer else None,
+        user=user
     )
 
 
+def older_feed_state():
+    # Validator of the page asked for; cursors are checked as in the view
+    before = request.args.get('before')
+    after = request.args.get('after')
+    return feed_state(
+        app.config['LECTURES_PER_PAGE'],
+        before=decode_cursor(before) if before is not None and after is None else None,
+        after=decode_cursor(after) if after is not None else None
+    )
+
+
+def feed_cache_key(*args):
+    # Feed pages only differ per user (delete links, menu) and change with the lectures themselves
+    user_id = current_user.id if current_user.is_authenticated else None
+    return (user_id, datetime.now().year) + args
+
+
 @app.route('/')
 @app.route('/home')
+@conditional_get(lambda: feed_state(app.config['LECTURES_PER_PAGE']))
 def home():
-    # Find lectures where all attendance records are marked as False (absent)
-    lectures_with_no_attendance = (
-        Lecture.query
-        .outerjoin(Attendance)
-        .group_by(Lecture.id)
-        .having(db.func.count(Attendance.id) == 0)  # No attendance records
-        .all()
-    )
+    def render():
+        # Fetch only the latest page of lectures
+        lectures, has_older = get_lecture_page()
+        return render_lectures_template(lectures=lectures, has_older=has_older)
+
+    return caching.cached('feed-page', feed_cache_key(), (caching.FEED,), render)
 
-    # Find lectures where all attendance records are marked 'False' (absent)
-    lectures_with_all_absent = (
-        Lecture.query
-        .join(Attendance)
-        .group_by(Lecture.id)
-        .having(db.func.count(Attendance.id) == db.func.count(Attendance.id).filter(
-            Attendance.status == False))  # All students absent
-        .all()
-    )
 
-    # Combine both queries
-    lectures_to_delete = set(lectures_with_no_attendance) | set(lectures_with_all_absent)
+@app.route('/older_lectures')
+@conditional_get(older_feed_state)
+def older():
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if before is None and after is None:
+        return redirect(url_for('home'))
 
-    # Delete attendance records for these lectures
-    for lecture in lectures_to_delete:
-        # Delete all attendance records related to the lecture
-        Attendance.query.filter_by(lecture_id=lecture.id).delete()
+    def render():
+        # None sends the request back to the home page
+        if after is not None:
+            lectures, has_newer = get_lecture_page(after=decode_cursor(after))
+            # The newest page is always served by the home page
+            if not has_newer:
+                return None
+            has_older = True
+        else:
+            lectures, has_older = get_lecture_page(before=decode_cursor(before))
+            has_newer = True
 
-    # Delete the lectures themselves
-    for lecture in lectures_to_delete:
-        db.session.delete(lecture)
+        if not lectures:
+            return None
 
-    # Commit the changes
-    db.session.commit()
+        return render_lectures_template(lectures=lectures, has_older=has_older, has_newer=has_newer)
 
-    # Fetch all lectures and reverse for latest-first display
-    lectures = Lecture.query.order_by(Lecture.timestamp.desc()).all()
-    total_lectures = len(lectures)
+    page = caching.cached('feed-page', feed_cache_key(before, after), (caching.FEED,), render)
+    return page if page is not None else redirect(url_for('home'))
 
-    return render_lectures_template(lectures=lectures, start=0, end=min(total_lectures, 5))
 
+def attendance_report(batch_id, subject_id):
+    import analytics  # NumPy is only loaded by the views that need it
+    # Calculate and rank attendance percentages for the whole batch at once
+    attendance_data = AttendanceStats.get_batch_report(batch_id, subject_id)
 
-@app.route('/older_lectures')
-def older():
-    lectures = Lecture.query.all()
-    lectures = lectures[::-1]
-    total_lectures = len(lectures)
-    return render_lectures_template(lectures=lectures, start=min(total_lectures, 5), end=None)
+    # Add recent attendance, absence streaks and recovery needs from the attendance matrix
+    metrics = analytics.student_metrics(
+        analytics.load_matrix(batch_id, subject_id, bitmaps=app.config['ATTENDANCE_STORAGE'] == 'bitmap'),
+        threshold=app.config['ATTENDANCE_THRESHOLD'],
+        last=app.config['RECENT_LECTURES']
+    )
+    metrics = {record['student_id']: record for record in metrics}
+    for record in attendance_data:
+        student_metrics = metrics[record['student_id']]
+        record['recent_percentage'] = student_metrics['recent_percentage']
+        record['longest_absence_streak'] = student_metrics['longest_absence_streak']
+        record['lectures_to_recover'] = student_metrics['lectures_to_recover']
+    return attendance_data
 
 
 @app.route("/attendance/", methods=['GET', 'POST'])
@@ -233,27 +378,19 @@ def get_attendance():
     form.batch.choices = [(batch.id, batch.name) for batch in Batch.query.all()]
 
     attendance_data = None
+    export_args = None
 
     if form.validate_on_submit():
         subject_id = form.subject.data
         batch_id = form.batch.data
 
-        # Calculate attendance percentages
-        students = Student.query.filter_by(batch_id=batch_id).all()
-        attendance_data = []
-
-        for student in students:
-            percentage = AttendanceStats.get_percentage(student.id, subject_id)
-            attendance_data.append({
-                'student_name': student.student_name,
-                'enrollment_number': student.enrollment_number,
-                'percentage': percentage
-            })
-
-        attendance_data = sorted(attendance_data, key=lambda x: x['percentage'], reverse=True)
-
-        for idx, record in enumerate(attendance_data, start=1):
-            record['rank'] = idx
+        attendance_data = caching.cached(
+            'attendance-report',
+            (batch_id, subject_id, app.config['ATTENDANCE_THRESHOLD'], app.config['RECENT_LECTURES']),
+            (caching.batch_scope(batch_id), caching.subject_scope(subject_id), caching.ROSTER),
+            lambda: attendance_report(batch_id, subject_id)
+        )
+        export_args = {'batch_id': batch_id, 'subject_id': subject_id}
 
     return render_template(
         "forms.html",
@@ -262,10 +399,258 @@ def get_attendance():
         action="Attendance",
         phrase="Get Attendance Report!",
         image=image,
-        attendance_data=attendance_data
+        attendance_data=attendance_data,
+        export_args=export_args,
+        threshold=app.config['ATTENDANCE_THRESHOLD'],
+        recent_lectures=app.config['RECENT_LECTURES']
+    )
+
+
+@app.route("/api/attendance/analytics")
+@conditional_get(lambda: report_state(request.args.get('batch_id', type=int), request.args.get('subject_id', type=int)))
+def attendance_analytics():
+    batch_id = request.args.get('batch_id', type=int)
+    subject_id = request.args.get('subject_id', type=int)
+    if batch_id is None or subject_id is None:
+        return jsonify({"message": "batch_id and subject_id are required."}), 400
+    threshold = request.args.get('threshold', app.config['ATTENDANCE_THRESHOLD'], type=float)
+    last = request.args.get('last', app.config['RECENT_LECTURES'], type=int)
+    if not 0 <= threshold <= 100:
+        return jsonify({"message": "threshold must be a percentage from 0 to 100."}), 400
+    if last < 1:
+        return jsonify({"message": "last must be at least 1."}), 400
+
+    import analytics
+    matrix = analytics.load_matrix(batch_id, subject_id, bitmaps=app.config['ATTENDANCE_STORAGE'] == 'bitmap')
+
+    # after_lecture is the subject's lecture number, as shown in the feed
+    after_lecture = request.args.get('after_lecture', type=int)
+    lecture_index = None
+    if after_lecture is not None:
+        lecture_index = matrix.lecture_index(after_lecture)
+        if lecture_index is None:
+            return jsonify({"message": f"Lecture {after_lecture} was not found."}), 404
+
+    return jsonify({
+        'batch_id': batch_id,
+        'subject_id': subject_id,
+        'threshold': threshold,
+        'last': last,
+        'lectures': [
+            {'id': lecture_id, 'sequence_number': sequence_number, 'timestamp': timestamp.isoformat()}
+            for lecture_id, timestamp, sequence_number in matrix.lectures
+        ],
+        'students': analytics.student_metrics(matrix, threshold, last, lecture_index)
+    })
+
+
+@app.route("/api/attendance/trends")
+def attendance_trends():
+    # Every batch and subject unless batch_id or subject_id narrows it down
+    try:
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"message": "start and end must be dates like 2024-07-01."}), 400
+    period = request.args.get('period', 'week')
+    batch_id = request.args.get('batch_id', type=int)
+    subject_id = request.args.get('subject_id', type=int)
+
+    try:
+        series = trends.attendance_trends(period, batch_id, subject_id, start, end)
+    except trends.TrendsError as error:
+        return jsonify({"message": str(error)}), 400
+    return jsonify({
+        'period': period,
+        'batch_id': batch_id,
+        'subject_id': subject_id,
+        'series': [{**point, 'start': point['start'].isoformat()} for point in series]
+    })
+
+
+@app.route("/attendance/defaulters", methods=['GET', 'POST'])
+@login_required
+def defaulters():
+    form = DefaulterReportForm()
+    if request.method == 'GET':
+        form.threshold.data = app.config['ATTENDANCE_THRESHOLD']
+    image = '../static/assets/img/post-bg.jpg'
+    form.batch.choices = [(batch.id, batch.name) for batch in Batch.query.all()]
+
+    defaulter_data = None
+    if form.validate_on_submit():
+        threshold = float(form.threshold.data)
+        subjects, students = reports.defaulter_report(form.batch.data, threshold)
+        defaulter_data = {
+            'subjects': subjects,
+            'students': students,
+            'threshold': threshold,
+            'batch_id': form.batch.data
+        }
+
+    return render_template(
+        "forms.html",
+        form=form,
+        user=current_user,
+        action="Defaulters",
+        phrase="Students below the attendance limit in any subject.",
+        image=image,
+        defaulter_data=defaulter_data
+    )
+
+
+@app.route("/attendance/defaulters.csv")
+@login_required
+@conditional_get(lambda: report_state(request.args.get('batch_id', type=int)))
+def export_defaulters():
+    batch = Batch.query.get_or_404(request.args.get('batch_id', type=int))
+    threshold = request.args.get('threshold', app.config['ATTENDANCE_THRESHOLD'], type=float)
+
+    filename = f"defaulters-{batch.name}.csv".replace(' ', '-')
+    return Response(
+        reports.defaulters_csv(batch.id, threshold),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@app.route("/attendance/export")
+@login_required
+@conditional_get(lambda: report_state(request.args.get('batch_id', type=int), request.args.get('subject_id', type=int)))
+def export_attendance():
+    batch = Batch.query.get_or_404(request.args.get('batch_id', type=int))
+    subject = Subject.query.get_or_404(request.args.get('subject_id', type=int))
+    try:
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return abort(400)
+
+    filename = f"attendance-{batch.name}-{subject.subject_name}.csv".replace(' ', '-')
+    return Response(
+        stream_with_context(
+            export.attendance_register_csv(batch.id, subject.id, start, end, app.config['ARCHIVE_DIR'])
+        ),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
     )
 
 
+def search_page():
+    # (query, page, students, has_next) of the search in the query string
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', app.config['STUDENTS_PER_PAGE'], type=int)
+    students, has_next = search.search_students(query, page, per_page)
+    return query, page, students, has_next
+
+
+@app.route("/students/search")
+@login_required
+def search_students():
+    try:
+        query, page, students, has_next = search_page()
+    except search.SearchError as error:
+        flash(str(error))
+        query, page, students, has_next = request.args.get('q', ''), 1, [], False
+
+    image = '../static/assets/img/post-bg.jpg'
+    return render_template(
+        "students.html",
+        user=current_user,
+        action="Students",
+        phrase="Find a student by name or enrollment number.",
+        image=image,
+        query=query,
+        page=page,
+        students=students,
+        has_next=has_next
+    )
+
+
+@app.route("/api/students/search")
+@login_required
+def search_students_api():
+    try:
+        query, page, students, has_next = search_page()
+    except search.SearchError as error:
+        return jsonify({"message": str(error)}), 400
+    return jsonify({
+        'query': query,
+        'page': page,
+        'next_page': page + 1 if has_next else None,
+        'students': [{
+            'id': student.id,
+            'student_name': student.student_name,
+            'enrollment_number': student.enrollment_number,
+            'batch_id': student.batch_id,
+            'batch': student.batch_name,
+            'url': url_for('student_attendance', enrollment_number=student.enrollment_number)
+        } for student in students]
+    })
+
+
+def student_report_json(report):
+    return {
+        **report,
+        'url': url_for('student_attendance', enrollment_number=report['enrollment_number']),
+        'recent_absences': [
+            {**absence, 'timestamp': absence['timestamp'].isoformat()} for absence in report['recent_absences']
+        ]
+    }
+
+
+@app.route("/student/<enrollment_number>")
+@login_required
+def student_attendance(enrollment_number):
+    report = student_report.student_report(enrollment_number)
+    if report is None:
+        abort(404)
+
+    # Absence times in IST, as in the lecture feed
+    absences = [{
+        **absence,
+        'formatted_timestamp': (absence['timestamp'] + timedelta(hours=5, minutes=30)).strftime('%B %d, %Y at %I:%M %p')
+    } for absence in report['recent_absences']]
+
+    image = '../static/assets/img/post-bg.jpg'
+    return render_template(
+        "student.html",
+        user=current_user,
+        action=report['student_name'],
+        phrase=f"{report['enrollment_number']} · {report['batch']}",
+        image=image,
+        report=report,
+        absences=absences,
+        threshold=app.config['ATTENDANCE_THRESHOLD']
+    )
+
+
+@app.route("/api/student/<enrollment_number>")
+@login_required
+def student_attendance_api(enrollment_number):
+    report = student_report.student_report(enrollment_number)
+    if report is None:
+        return jsonify({"message": f"No student has enrollment number {enrollment_number}."}), 404
+    return jsonify(student_report_json(report))
+
+
+@app.route("/api/students/attendance")
+@login_required
+def students_attendance_api():
+    # Mentor views: ?enrollment_numbers=0101IT221000,0101IT221001,...
+    enrollment_numbers = [
+        number.strip() for number in request.args.get('enrollment_numbers', '').split(',') if number.strip()
+    ]
+    if not enrollment_numbers:
+        return jsonify({"message": "enrollment_numbers is required."}), 400
+    try:
+        found, missing = student_report.student_reports(enrollment_numbers)
+    except student_report.StudentReportError as error:
+        return jsonify({"message": str(error)}), 400
+    return jsonify({'students': [student_report_json(report) for report in found], 'missing': missing})
+
+
 @app.route("/lecture/<int:lecture_id>", methods=['GET', 'POST'])
 def get_lecture_attendance(lecture_id):
     return redirect(
@@ -290,10 +675,12 @@ def add_new_lecture():
             subject_id=form.subject.data,
             teacher_id=current_user.id,
             batch_id=form.batch.data,
-            timestamp=datetime.now(timezone.utc)
+            timestamp=datetime.now(timezone.utc),
+            sequence_number=Lecture.next_sequence_number(form.subject.data)
         )
         db.session.add(new_lecture)
         db.session.commit()
+        caching.lectures_changed(new_lecture.batch_id, new_lecture.subject_id)
         flash('Lecture created successfully!', 'success')
 
         # Redirect to mark attendance for this lecture and batch
@@ -314,34 +701,42 @@ def add_new_lecture():
         image=image
     )
 
+def load_attendance_sheet(lecture):
+    # Students of the lecture's batch, sorted by enrollment number, and their recorded statuses
+    students = [
+        {'id': student.id, 'student_name': student.student_name, 'enrollment_number': student.enrollment_number}
+        for student in Student.query.filter_by(batch_id=lecture.batch_id).order_by(Student.enrollment_number)
+    ]
+    existing_attendance = {
+        att.student_id: att.status for att in Attendance.query.filter_by(lecture_id=lecture.id).all()
+    }
+    return students, existing_attendance
+
+
 @app.route('/mark-attendance', methods=['GET', 'POST'])
+@conditional_get(lambda: lecture_state(request.args.get('lecture_id', type=int)))
 def mark_attendance():
     lecture_id = request.args.get('lecture_id', type=int)
-    lecture = Lecture.query.get_or_404(lecture_id)
+    lecture = Lecture.query.options(joinedload(Lecture.subject)).get_or_404(lecture_id)
     batch_id = lecture.batch_id
 
     # Determine if the current user is logged in and is the creator of the lecture
     is_creator = current_user.is_authenticated and lecture.teacher_id == current_user.id
 
-    # Calculate the lecture number for the subject
-    lecture_number = (
-        Lecture.query.filter_by(subject_id=lecture.subject_id)
-        .order_by(Lecture.timestamp)
-        .with_entities(Lecture.id)
-        .all()
-    )
-    lecture_index = [l.id for l in lecture_number].index(lecture_id) + 1
-
-    # Sort students based on enrollment number
-    students = Student.query.filter_by(batch_id=batch_id).order_by(Student.enrollment_number).all()
+    # Submissions always work on fresh records; the sheet shown on GET is cached
+    if request.method == 'POST':
+        students, existing_attendance = load_attendance_sheet(lecture)
+    else:
+        students, existing_attendance = caching.cached(
+            'attendance-sheet', (lecture_id,),
+            (caching.batch_scope(batch_id), caching.lecture_scope(lecture_id), caching.ROSTER),
+            lambda: load_attendance_sheet(lecture)
+        )
 
     if not students:
         flash("No students found in the selected batch.", "danger")
         return redirect(url_for('home'))
 
-    # Fetch existing attendance records for the lecture
-    existing_attendance = {att.student_id: att.status for att in Attendance.query.filter_by(lecture_id=lecture_id).all()}
-
     form = AttendanceForm()
     form.lecture_id.data = lecture_id
 
@@ -352,34 +747,21 @@ def mark_attendance():
             return redirect(url_for('mark_attendance', lecture_id=lecture_id))
 
         if form.validate_on_submit():
-            attendance_records = []
-            for student in students:
-                # Check if attendance is marked as "Present" (checkbox is ticked)
-                attendance_status = request.form.get(f'attendance_{student.id}') == 'on'
-                existing_record = existing_attendance.get(student.id)
-
-                if existing_record is None:
-                    # Create new record if no existing record is found
-                    attendance_records.append(Attendance(
-                        lecture_id=lecture_id,
-                        student_id=student.id,
-                        status=attendance_status
-                    ))
-                elif existing_record != attendance_status:
-                    # Update the record only if the status has changed
-                    attendance = Attendance.query.filter_by(lecture_id=lecture_id, student_id=student.id).first()
-                    attendance.status = attendance_status
-
-            if attendance_records:
-                db.session.bulk_save_objects(attendance_records)
+            # Checked boxes mark a student "Present"; only changed records are written
+            statuses = {
+                student['id']: request.form.get(f"attendance_{student['id']}") == 'on' for student in students
+            }
+            changed = AttendanceStats.record_attendance(lecture, statuses)
             db.session.commit()
+            if changed:
+                caching.attendance_changed(lecture)
 
             flash("Attendance marked successfully!", "success")
             return redirect(url_for('home'))
 
     # Prepare the pre-checked status for each student based on existing attendance
     attendance_status_map = {
-        student.id: existing_attendance.get(student.id, False) for student in students
+        student['id']: existing_attendance.get(student['id'], False) for student in students
     }
 
     image = '../static/assets/img/post-bg.jpg'
@@ -393,18 +775,35 @@ def mark_attendance():
         user=current_user,
         is_creator=is_creator,
         action="Mark Attendance",
-        phrase=f"Lecture {lecture_index} - {lecture.subject.subject_name}",
+        phrase=f"Lecture {lecture.sequence_number} - {lecture.subject.subject_name}",
         image=image
     )
 
 
+@app.route('/api/sync', methods=['POST'])
+@login_required
+def sync_attendance():
+    # JSON only: cross-site forms cannot send it, which stands in for the CSRF token of the forms
+    if not request.is_json:
+        return jsonify({"message": "Send the lectures as application/json."}), 415
+    try:
+        results = sync.sync(current_user, request.get_json(silent=True))
+    except sync.SyncError as error:
+        return jsonify({"message": str(error)}), 400
+    return jsonify({'lectures': results})
+
+
 @app.route('/delete-lecture/<lecture_id>', methods=['GET', 'DELETE'])
 @creator_only
 def delete_lecture(lecture_id):
     lecture = db.session.query(Lecture).get(lecture_id)
+    AttendanceStats.forget_lectures([lecture.id])
     db.session.query(Attendance).filter_by(lecture_id=lecture_id).delete()
     db.session.delete(lecture)
+    db.session.flush()
+    Lecture.renumber([lecture.subject_id])
     db.session.commit()
+    caching.lectures_changed(lecture.batch_id, lecture.subject_id)
     return redirect(url_for('home'))
 
 
@@ -491,10 +890,12 @@ def add_new_student():
         new_student = Student(
             student_name=student_name,
             enrollment_number=enrollment_number,
-            batch_id=batch_id
+            batch_id=batch_id,
+            batch_index=Student.next_batch_index(batch_id)
         )
         db.session.add(new_student)
         db.session.commit()
+        caching.roster_changed(batch_id)
 
         flash("Student added successfully!", "success")
         return redirect(url_for('add_new_student'))
@@ -511,6 +912,45 @@ def add_new_student():
     )
 
 
+@app.route('/import-students', methods=['GET', 'POST'])
+@admin_only
+def import_students():
+    form = StudentImportForm()
+    form.batch.choices = [(batch.id, batch.name) for batch in Batch.query.all()]
+    import_report = None
+
+    if form.validate_on_submit():
+        roster = form.roster.data
+        try:
+            import_report = importer.import_students(
+                importer.read_roster(roster.stream, roster.filename),
+                default_batch_id=form.batch.data
+            )
+            flash(f"Imported {import_report.imported} students, rejected {import_report.error_count} rows.")
+        except (ValueError, UnicodeDecodeError) as e:
+            db.session.rollback()
+            flash(f"Could not read the roster: {e}")
+        # Chunks are committed as they go, so earlier ones are in even if the file failed later
+        caching.roster_changed()
+
+    image = '../static/assets/img/post-bg.jpg'
+    return render_template(
+        'forms.html',
+        form=form,
+        user=current_user,
+        action="Import Students",
+        phrase="Upload a whole roster at once.",
+        image=image,
+        import_report=import_report
+    )
+
+
+@app.route('/metrics')
+@admin_only
+def metrics():
+    return jsonify({'cache': caching.cache.stats(), 'database': database.metrics(), 'users': principals.metrics()})
+
+
 @app.route('/about')
 def about():
     year = datetime.now().year
@@ -525,30 +965,196 @@ def contact():
 
 @app.route('/send_mail', methods=["POST"])
 def send_mail():
+    data = request.get_json(silent=True)
+    if not data or not all(data.get(field) for field in ('name', 'email', 'message')):
+        return jsonify({"message": "Name, email and message are required."}), 400
+
+    # Queued and answered right away; the mail worker delivers it
+    try:
+        mailer.enqueue(
+            EMAIL,
+            "New Contact Form Submission",
+            f"Name: {data['name']}\n"
+            f"Email: {data['email']}\n"
+            f"Phone: {data.get('phone', '')}\n"
+            f"Message: {data['message']}",
+            reply_to=data['email']
+        )
+    except ValueError:
+        return jsonify({"message": "Invalid email address."}), 400
+    db.session.commit()
+    mailer.wake_worker()
+
+    return jsonify({"message": "Form submission received!"}), 202
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Create the schema or bring an existing database up to date; run once per deployment."""
+    import migrations
+    migrations.upgrade(echo=click.echo)
+    click.echo(f"Database is at schema version {migrations.current_version()}.")
+
+
+@app.cli.command('schema-status')
+def schema_status():
+    """Show the schema version and any pending migrations."""
+    import migrations
+    click.echo(f"Database is at schema version {migrations.current_version()}.")
+    for version, description, _ in migrations.pending_migrations():
+        click.echo(f"Pending migration {version}: {description}")
+
+
+@app.cli.command('sweep-lectures')
+@click.option('--grace-minutes', type=int, default=None,
+              help="Only sweep lectures older than this many minutes.")
+@click.option('--batch-size', type=int, default=None, help="Lectures deleted per transaction.")
+def sweep_lectures(grace_minutes, batch_size):
+    """Delete lectures where no student was marked present."""
+    grace_period = app.config['SWEEP_GRACE_PERIOD']
+    if grace_minutes is not None:
+        grace_period = timedelta(minutes=grace_minutes)
+    lectures, attendance = sweep_stale_lectures(grace_period, batch_size or app.config['SWEEP_BATCH_SIZE'])
+    click.echo(f"Removed {lectures} lectures and {attendance} attendance records.")
+
+
+@app.cli.command('rebuild-attendance-stats')
+@click.option('--check', is_flag=True, help="Only report drift, do not rewrite the summary.")
+def rebuild_attendance_stats(check):
+    """Recompute the attendance summary table from the attendance records."""
+    drifted = AttendanceStats.rebuild_summary(dry_run=check)
+    db.session.commit()
+    if drifted and not check:
+        caching.cache.clear()
+    if not drifted:
+        click.echo("Attendance summary is in sync.")
+    elif check:
+        click.echo(f"{drifted} student/subject counters have drifted.")
+        raise SystemExit(1)
+    else:
+        click.echo(f"Rebuilt attendance summary; {drifted} student/subject counters had drifted.")
+
+
+@app.cli.command('rebuild-attendance-rollups')
+@click.option('--check', is_flag=True, help="Only report drift, do not rewrite the rollups.")
+def rebuild_attendance_rollups(check):
+    """Recompute the daily attendance rollups behind the trends API from the attendance records."""
+    # The rollups of archived terms are kept; their attendance records are no longer live
+    archived_until = archive.archived_until(app.config['ARCHIVE_DIR'])
+    drifted = AttendanceRollup.rebuild(dry_run=check, archived_until=archived_until)
+    db.session.commit()
+    if not drifted:
+        click.echo("Attendance rollups are in sync.")
+    elif check:
+        click.echo(f"{drifted} batch/subject/day rollups have drifted.")
+        raise SystemExit(1)
+    else:
+        click.echo(f"Rebuilt attendance rollups; {drifted} batch/subject/day rollups had drifted.")
+
+
+@app.cli.command('rebuild-attendance-bitmaps')
+def rebuild_attendance_bitmaps():
+    """Convert the attendance records of every lecture into bitmaps; run before setting ATTENDANCE_STORAGE=bitmap."""
+    Student.assign_batch_indexes()
+    converted = LectureBitmap.rebuild()
+    db.session.commit()
+    caching.cache.clear()
+    click.echo(f"Rebuilt the attendance bitmaps of {converted} lectures.")
+
+
+@app.cli.command('archive-term')
+@click.argument('name')
+@click.option('--start', required=True, type=click.DateTime(formats=['%Y-%m-%d']), help="First day of the term.")
+@click.option('--end', required=True, type=click.DateTime(formats=['%Y-%m-%d']), help="Last day of the term.")
+def archive_term(name, start, end):
+    """Move a closed term's lectures and attendance from the live tables to ARCHIVE_DIR."""
+    start, end = start.date(), end.date()
     try:
-        data = request.get_json()
-        if not data:
-            raise ValueError("No data received")
-
-        if request.method == 'POST':
-            with smtplib.SMTP("smtp.gmail.com", port=587) as connection:
-                connection.starttls()
-                connection.login(EMAIL, PASSWORD)
-                connection.sendmail(
-                    EMAIL,
-                    EMAIL,
-                    msg=f"Subject: New Contact Form Submission\n\n"
-                        f"Name: {data['name']}\n"
-                        f"Email: {data['email']}\n"
-                        f"Phone: {data['phone']}\n"
-                        f"Message: {data['message']}"
-                )
-
-        return jsonify({"message": "Form submission successful!"}), 200
-
-    except Exception as e:
-        print(f"Error: {e}")
-        return jsonify({"message": "Error processing the form submission."}), 500
+        term = archive.archive_term(app.config['ARCHIVE_DIR'], name, *export.timestamp_range(start, end), start, end)
+    except archive.ArchiveError as error:
+        raise click.ClickException(str(error))
+    caching.cache.clear()
+    click.echo(f"Archived {term['lectures']['rows']} lectures and {term['attendance']['rows']} attendance records "
+               f"of {name} to {os.path.join(app.config['ARCHIVE_DIR'], name)}.")
+
+
+@app.cli.command('revoke-sessions')
+@click.argument('email')
+def revoke_sessions(email):
+    """Log a user out of every session."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No user with the email {email}.")
+    principals.revoke_sessions(user)
+    db.session.commit()
+    click.echo(f"Revoked every session of {user.name}.")
+
+
+@app.cli.command('seed-demo')
+@click.option('--batches', default=20, show_default=True)
+@click.option('--students', default=120, show_default=True, help="Average students per batch.")
+@click.option('--lectures', default=400, show_default=True, help="Lectures per batch.")
+@click.option('--seed', default=0, show_default=True, help="Random seed; the same seed gives the same data.")
+def seed_demo(batches, students, lectures, seed):
+    """Fill an empty database with realistic demo data."""
+    try:
+        counts = demo.seed_demo(batches, students, lectures, seed)
+    except demo.DemoError as error:
+        raise click.ClickException(str(error))
+    caching.cache.clear()
+    click.echo("Created " + ", ".join(f"{count} {table}" for table, count in counts.items()) + ".")
+    click.echo(f"Log in as admin@example.com or teacher1@example.com with the password {demo.DEMO_PASSWORD}.")
+
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch', 'batch_name', help="Batch for rows without a batch column.")
+def import_students_command(path, batch_name):
+    """Import students from a CSV or XLSX roster."""
+    default_batch_id = None
+    if batch_name:
+        batch = Batch.query.filter_by(name=batch_name).first()
+        if not batch:
+            raise click.BadParameter(f"Batch '{batch_name}' does not exist.", param_hint='--batch')
+        default_batch_id = batch.id
+
+    with open(path, 'rb') as roster:
+        report = importer.import_students(importer.read_roster(roster, path), default_batch_id=default_batch_id)
+    caching.roster_changed()
+
+    for line, enrollment_number, message in report.errors:
+        click.echo(f"Line {line} ({enrollment_number or 'no enrollment number'}): {message}")
+    click.echo(f"Imported {report.imported} students, rejected {report.error_count} rows.")
+
+
+@app.cli.command('send-mail-queue')
+@click.option('--batch-size', type=int, default=None, help="Messages sent over one connection per batch.")
+@click.option('--watch', type=int, default=0, help="Keep running and deliver every this many seconds.")
+def send_mail_queue(batch_size, watch):
+    """Deliver the queued mail that is due; with --watch, run as a mail worker."""
+    while True:
+        sent, failed = mailer.deliver_queue(batch_size)
+        if not watch or sent or failed:
+            click.echo(f"Sent {sent} messages, {failed} failed permanently.")
+        if not watch:
+            return
+        db.session.remove()  # Do not hold a connection while sleeping
+        time.sleep(watch)
+
+
+@app.cli.command('send-attendance-alerts')
+@click.option('--batch', 'batch_name', required=True, help="Batch whose students are checked.")
+@click.option('--threshold', type=float, default=None, help="Attendance percentage to alert below.")
+def send_attendance_alerts(batch_name, threshold):
+    """Queue a low-attendance digest to the teacher of every subject of a batch."""
+    batch = Batch.query.filter_by(name=batch_name).first()
+    if not batch:
+        raise click.BadParameter(f"Batch '{batch_name}' does not exist.", param_hint='--batch')
+
+    messages = mailer.low_attendance_alerts(batch.id, threshold or app.config['ATTENDANCE_THRESHOLD'])
+    queued = mailer.enqueue_many(messages)
+    db.session.commit()
+    click.echo(f"Queued {queued} low-attendance alerts for batch {batch.name}.")
 
 
 @app.errorhandler(404)
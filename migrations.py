@@ -0,0 +1,173 @@
+"""Versioned schema migrations.
+
+`db.create_all()` only creates missing tables, so changes to existing tables (new columns,
+indexes, constraints) are applied here. Every migration has a version number and is recorded
+in the schema_migrations table once applied; `upgrade()` runs the pending ones in order.
+Migrations check the current schema before changing it, so they are also safe to run against
+a database that `db.create_all()` has just created at the latest schema.
+"""
+from datetime import datetime, timezone
+import search
+from models import db, User, Batch, Student, Subject, Lecture, Attendance, AttendanceStats, AttendanceSummary, \
+    AttendanceRollup, LectureBitmap, utcnow
+
+MIGRATIONS = []
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<SchemaMigration {self.version}: {self.description}>"
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+    return register
+
+
+def has_column(table, column):
+    return column in {c['name'] for c in db.inspect(db.session.connection()).get_columns(table)}
+
+
+def has_index(table, index):
+    return index in {i['name'] for i in db.inspect(db.session.connection()).get_indexes(table)}
+
+
+def create_indexes(model, names=None):
+    # Create the indexes declared on a model (or only the named ones) that the database does not have yet
+    for index in model.__table__.indexes:
+        if names is None or index.name in names:
+            index.create(db.session.connection(), checkfirst=True)
+
+
+@migration(1, "Store per-subject lecture sequence numbers")
+def add_lecture_sequence_number():
+    if not has_column('lectures', 'sequence_number'):
+        db.session.execute(db.text('ALTER TABLE lectures ADD COLUMN sequence_number INTEGER'))
+        # Plain SQL rather than Lecture.renumber(), which also stamps updated_at and counts on from
+        # subjects.archived_lectures, columns that later migrations add
+        db.session.execute(db.text(
+            'UPDATE lectures SET sequence_number = numbered.number FROM ('
+            'SELECT id, row_number() OVER (PARTITION BY subject_id ORDER BY timestamp, id) AS number '
+            'FROM lectures) AS numbered '
+            'WHERE lectures.id = numbered.id'
+        ))
+
+
+@migration(2, "Fill the attendance summary counters")
+def fill_attendance_summary():
+    if db.session.query(Attendance.id).first() and not db.session.query(AttendanceSummary.student_id).first():
+        AttendanceStats.rebuild_summary()
+
+
+@migration(3, "One attendance record per student and lecture")
+def add_attendance_uniqueness():
+    if has_index('attendance', 'uq_attendance_lecture_student'):
+        return
+
+    # Keep only the latest record per student and lecture before enforcing uniqueness
+    latest = db.select(db.func.max(Attendance.id)).group_by(Attendance.lecture_id, Attendance.student_id)
+    duplicates = db.session.execute(
+        db.delete(Attendance)
+        .where(Attendance.id.not_in(latest))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.execute(db.text(
+        'CREATE UNIQUE INDEX uq_attendance_lecture_student ON attendance (lecture_id, student_id)'
+    ))
+    if duplicates:
+        AttendanceStats.rebuild_summary()
+
+
+@migration(4, "Indexes for the feed, roster, report and subject lookups")
+def add_lookup_indexes():
+    # By name: the models also declare indexes on columns that later migrations add
+    create_indexes(Student, {'ix_students_batch_enrollment'})
+    create_indexes(Subject, {'ix_subjects_teacher_id'})
+    create_indexes(Lecture, {
+        'ix_lectures_timestamp_id', 'ix_lectures_subject_timestamp', 'ix_lectures_batch_subject_timestamp'
+    })
+    create_indexes(Attendance, {'ix_attendance_student_lecture'})
+
+
+@migration(5, "Creation and modification timestamps on every table")
+def add_timestamps():
+    datetime_type = db.DateTime().compile(dialect=db.session.get_bind().dialect)
+    now = utcnow()
+    for model in (User, Batch, Student, Subject, Lecture, Attendance):
+        table = model.__tablename__
+        for column in ('created_at', 'updated_at'):
+            if not has_column(table, column):
+                # Existing rows are stamped with the upgrade time; their real history is unknown
+                db.session.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {column} {datetime_type}'))
+                db.session.execute(db.text(f'UPDATE {table} SET {column} = :now'), {'now': now})
+
+
+@migration(6, "Per-batch student indexes and attendance bitmaps")
+def add_attendance_bitmaps():
+    if not has_column('students', 'batch_index'):
+        db.session.execute(db.text('ALTER TABLE students ADD COLUMN batch_index INTEGER'))
+    Student.assign_batch_indexes()
+    create_indexes(Student)
+    LectureBitmap.rebuild()
+
+
+@migration(7, "Count of archived lectures per subject")
+def add_archived_lecture_counts():
+    if not has_column('subjects', 'archived_lectures'):
+        db.session.execute(db.text('ALTER TABLE subjects ADD COLUMN archived_lectures INTEGER NOT NULL DEFAULT 0'))
+
+
+@migration(8, "Session versions for revoking logins")
+def add_session_versions():
+    if not has_column('users', 'session_version'):
+        db.session.execute(db.text('ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0'))
+
+
+@migration(9, "Search index over student names and enrollment numbers")
+def add_student_search_index():
+    search.create_index()
+
+
+@migration(10, "Fill the daily attendance rollups")
+def fill_attendance_rollups():
+    if db.session.query(Attendance.id).first() and not db.session.query(AttendanceRollup.day).first():
+        AttendanceRollup.rebuild()
+
+
+def current_version():
+    # A database that upgrade() has never run against has no schema_migrations table
+    if not db.inspect(db.session.connection()).has_table(SchemaMigration.__tablename__):
+        return 0
+    return db.session.query(db.func.max(SchemaMigration.version)).scalar() or 0
+
+
+def pending_migrations():
+    version = current_version()
+    return [entry for entry in MIGRATIONS if entry[0] > version]
+
+
+def upgrade(echo=print):
+    """Create missing tables and apply pending migrations, each in its own transaction."""
+    db.create_all()
+
+    applied = []
+    for version, description, func in pending_migrations():
+        func()
+        db.session.add(SchemaMigration(
+            version=version,
+            description=description,
+            applied_at=datetime.now(timezone.utc)
+        ))
+        db.session.commit()
+        echo(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
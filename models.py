@@ -1,18 +1,46 @@
+from datetime import datetime, timedelta, timezone
+from flask import current_app
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import Enum
+from sqlalchemy.dialects import postgresql, sqlite
 
 db = SQLAlchemy()
 
+UPSERT_CHUNK_SIZE = 1000  # Rows per multi-row upsert
+IST_OFFSET = timedelta(hours=5, minutes=30)  # Rollup days are calendar days in IST
+
+
+def dialect_insert(model):
+    # INSERT ... ON CONFLICT is dialect specific, but PostgreSQL and SQLite share the same API
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def lock_rows(model, ids):
+    # SELECT ... FOR UPDATE of parent rows, held until the transaction ends, so that writers that
+    # number the children of the same subject or batch take turns instead of reading the same max().
+    # Only PostgreSQL needs it: SQLite runs one write transaction at a time.
+    ids = sorted(set(ids))
+    if ids and db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(db.select(model.id).where(model.id.in_(ids)).order_by(model.id).with_for_update())
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Set in Python rather than by the database so that writes within the same second (SQLite's
+# CURRENT_TIMESTAMP resolution) still get distinct timestamps for conditional requests
 class BaseModel(db.Model):
     __abstract__ = True
-    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
-    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(),
-                          onupdate=db.func.current_timestamp())
+    created_at = db.Column(db.DateTime, default=utcnow)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
 
 
 # User model (for Admin and Teacher users)
-class User(db.Model, UserMixin):
+class User(BaseModel, UserMixin):
     __tablename__ = 'users'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -20,6 +48,7 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(100), nullable=False)
     is_admin = db.Column(db.Boolean, nullable=False, default=False)
+    session_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped to log out every session
 
     # Relationship: a user can create many subjects
     subjects = db.relationship('Subject', backref='teacher', lazy=True)
@@ -30,8 +59,12 @@ class User(db.Model, UserMixin):
     def __repr__(self):
         return f"<User {self.name}>"
 
+    def get_id(self):
+        # Stored in the session by Flask-Login; sessions from before a version bump no longer load
+        return f"{self.id}:{self.session_version}"
 
-class Batch(db.Model):
+
+class Batch(BaseModel):
     __tablename__ = 'batches'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -45,13 +78,20 @@ class Batch(db.Model):
 
 
 # Student model
-class Student(db.Model):
+class Student(BaseModel):
     __tablename__ = 'students'
+    __table_args__ = (
+        # Batch rosters are always listed by enrollment number
+        db.Index('ix_students_batch_enrollment', 'batch_id', 'enrollment_number'),
+        # Bit position of the student in the attendance bitmaps of the batch's lectures
+        db.Index('uq_students_batch_index', 'batch_id', 'batch_index', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     student_name = db.Column(db.String(100), nullable=False)
     enrollment_number = db.Column(db.String(20), unique=True, nullable=False)
     batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=False)
+    batch_index = db.Column(db.Integer)  # Position within the batch, never reused
 
     # Relationship: a student can have multiple attendance records
     attendance = db.relationship('Attendance', backref='student', lazy=True)
@@ -59,14 +99,52 @@ class Student(db.Model):
     def __repr__(self):
         return f"<Student {self.student_name} ({self.enrollment_number})>"
 
+    @staticmethod
+    def next_batch_index(batch_id):
+        # Evaluated inside the INSERT, like Lecture.next_sequence_number; locks the batch row until
+        # the caller commits, so that concurrent additions to the batch get distinct indexes
+        lock_rows(Batch, [batch_id])
+        return db.select(
+            db.func.coalesce(db.func.max(Student.batch_index), -1) + 1
+        ).where(
+            Student.batch_id == batch_id
+        ).scalar_subquery()
+
+    @staticmethod
+    def assign_batch_indexes():
+        # Give students inserted in bulk the next free indexes of their batch, in id order, in one UPDATE
+        numbered = db.select(
+            Student.id,
+            Student.batch_index,
+            (
+                db.func.coalesce(db.func.max(Student.batch_index).over(partition_by=Student.batch_id), -1) +
+                db.func.row_number().over(
+                    partition_by=(Student.batch_id, Student.batch_index.is_(None)),
+                    order_by=Student.id
+                )
+            ).label('number')
+        ).subquery()
+
+        db.session.execute(
+            db.update(Student)
+            .where(Student.id == numbered.c.id)
+            .where(numbered.c.batch_index.is_(None))
+            .values(batch_index=numbered.c.number)
+            .execution_options(synchronize_session=False)
+        )
+
 
 # Subject model
-class Subject(db.Model):
+class Subject(BaseModel):
     __tablename__ = 'subjects'
+    __table_args__ = (
+        db.Index('ix_subjects_teacher_id', 'teacher_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     subject_name = db.Column(db.String(100), nullable=False)
     teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    archived_lectures = db.Column(db.Integer, nullable=False, default=0)  # Lectures moved to term archives
 
     # Relationships
     lectures = db.relationship('Lecture', back_populates='subject')
@@ -76,14 +154,20 @@ class Subject(db.Model):
 
 
 # Lecture model
-class Lecture(db.Model):
+class Lecture(BaseModel):
     __tablename__ = 'lectures'
+    __table_args__ = (
+        db.Index('ix_lectures_timestamp_id', 'timestamp', 'id'),  # Keyset pagination of the feed
+        db.Index('ix_lectures_subject_timestamp', 'subject_id', 'timestamp'),  # Sequence numbering
+        db.Index('ix_lectures_batch_subject_timestamp', 'batch_id', 'subject_id', 'timestamp'),  # Batch reports
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
     subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), nullable=False)
     teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), nullable=False)
+    sequence_number = db.Column(db.Integer)  # Position of the lecture within its subject
 
     # Relationships
     subject = db.relationship('Subject', back_populates='lectures')  # Fix: Use back_populates
@@ -93,9 +177,52 @@ class Lecture(db.Model):
     def __repr__(self):
         return f"<Lecture {self.id} for Subject {self.subject_id} on {self.timestamp}>"
 
+    @staticmethod
+    def next_sequence_number(subject_id):
+        # Evaluated inside the INSERT. A max() read in the same statement is not enough on its own:
+        # two transactions can read the same max before either commits, so the subject row is
+        # locked until the caller commits. Numbering carries on after the lectures of archived terms.
+        lock_rows(Subject, [subject_id])
+        archived = db.select(Subject.archived_lectures).where(Subject.id == subject_id).scalar_subquery()
+        return db.select(
+            db.func.coalesce(db.func.max(Lecture.sequence_number), archived, 0) + 1
+        ).where(
+            Lecture.subject_id == subject_id
+        ).scalar_subquery()
 
-class Attendance(db.Model):
+    @staticmethod
+    def renumber(subject_ids=None):
+        # Recompute the sequence numbers of the given subjects (or all of them) in one UPDATE,
+        # counting on from the subject's archived lectures
+        numbered = db.select(
+            Lecture.id,
+            (Subject.archived_lectures + db.func.row_number().over(
+                partition_by=Lecture.subject_id,
+                order_by=(Lecture.timestamp, Lecture.id)
+            )).label('number')
+        ).join(
+            Subject, Subject.id == Lecture.subject_id
+        )
+        if subject_ids is not None:
+            numbered = numbered.where(Lecture.subject_id.in_(subject_ids))
+        numbered = numbered.subquery()
+
+        db.session.execute(
+            db.update(Lecture)
+            .where(Lecture.id == numbered.c.id)
+            .where(Lecture.sequence_number.is_distinct_from(numbered.c.number))
+            .values(sequence_number=numbered.c.number)
+            .execution_options(synchronize_session=False)
+        )
+
+
+class Attendance(BaseModel):
     __tablename__ = 'attendance'
+    __table_args__ = (
+        # One record per student per lecture; also the conflict target of the attendance upsert
+        db.Index('uq_attendance_lecture_student', 'lecture_id', 'student_id', unique=True),
+        db.Index('ix_attendance_student_lecture', 'student_id', 'lecture_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     status = db.Column(db.Boolean, nullable=False)
@@ -108,6 +235,245 @@ class Attendance(db.Model):
         return f"<Attendance Lecture {self.lecture_id} - {'Present' if self.status else 'Absent'} for {self.student_id}>"
 
 
+# A lecture's roll call as two bitmaps over the batch indexes of its students: who was marked at all
+# and who was marked present. Kept in step with the attendance rows with ATTENDANCE_STORAGE=bitmap.
+class LectureBitmap(db.Model):
+    __tablename__ = 'lecture_bitmaps'
+
+    lecture_id = db.Column(db.Integer, db.ForeignKey('lectures.id'), primary_key=True)
+    marked = db.Column(db.LargeBinary, nullable=False)
+    present = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    def __repr__(self):
+        return f"<LectureBitmap Lecture {self.lecture_id}: {len(self.marked)} bytes>"
+
+    @staticmethod
+    def pack(indexes):
+        # Little-endian bitmap with bit i set for every index i; bit 0 is the lowest bit of byte 0
+        bits = 0
+        for index in indexes:
+            bits |= 1 << index
+        return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+    @staticmethod
+    def unpack(bitmap):
+        bits = int.from_bytes(bitmap, 'little')
+        return [index for index in range(bits.bit_length()) if bits >> index & 1]
+
+    @staticmethod
+    def from_statuses(statuses):
+        # {batch_index: status} -> (marked, present) bitmaps
+        return (
+            LectureBitmap.pack(statuses),
+            LectureBitmap.pack(index for index, status in statuses.items() if status)
+        )
+
+    def statuses(self):
+        # {batch_index: status} for every student marked in the lecture
+        present = set(LectureBitmap.unpack(self.present))
+        return {index: index in present for index in LectureBitmap.unpack(self.marked)}
+
+    @staticmethod
+    def enabled():
+        return current_app.config.get('ATTENDANCE_STORAGE') == 'bitmap'
+
+    @staticmethod
+    def refresh(lecture_ids):
+        # Rebuild the bitmaps of the given lectures from their attendance rows with one read and one upsert
+        if not lecture_ids:
+            return
+
+        def marks():
+            return db.session.execute(
+                db.select(Attendance.lecture_id, Student.batch_index, Attendance.status)
+                .join(Student, Student.id == Attendance.student_id)
+                .where(Attendance.lecture_id.in_(lecture_ids))
+            ).all()
+
+        rows = marks()
+        if any(batch_index is None for _, batch_index, _ in rows):
+            Student.assign_batch_indexes()
+            rows = marks()
+
+        statuses = {lecture_id: {} for lecture_id in lecture_ids}
+        for lecture_id, batch_index, status in rows:
+            statuses[lecture_id][batch_index] = status
+        values = []
+        for lecture_id, lecture_statuses in statuses.items():
+            marked, present = LectureBitmap.from_statuses(lecture_statuses)
+            values.append({'lecture_id': lecture_id, 'marked': marked, 'present': present, 'updated_at': utcnow()})
+
+        for start in range(0, len(values), UPSERT_CHUNK_SIZE):
+            stmt = dialect_insert(LectureBitmap).values(values[start:start + UPSERT_CHUNK_SIZE])
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=[LectureBitmap.lecture_id],
+                set_={'marked': stmt.excluded.marked, 'present': stmt.excluded.present,
+                      'updated_at': stmt.excluded.updated_at}
+            ))
+
+    @staticmethod
+    def rebuild(chunk_size=UPSERT_CHUNK_SIZE):
+        # Convert the attendance rows of every lecture, a chunk of lectures at a time; returns the lecture count
+        converted = 0
+        last_id = 0
+        while True:
+            lecture_ids = db.session.scalars(
+                db.select(Lecture.id).where(Lecture.id > last_id).order_by(Lecture.id).limit(chunk_size)
+            ).all()
+            if not lecture_ids:
+                return converted
+            LectureBitmap.refresh(lecture_ids)
+            converted += len(lecture_ids)
+            last_id = lecture_ids[-1]
+
+
+# Running attended/total counts per student and subject, kept in step with the attendance table
+class AttendanceSummary(db.Model):
+    __tablename__ = 'attendance_summary'
+
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), primary_key=True)
+    attended = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<AttendanceSummary Student {self.student_id} Subject {self.subject_id}: {self.attended}/{self.total}>"
+
+
+# Present and total marks per batch, subject and day, kept in step with the attendance table for trend charts
+class AttendanceRollup(db.Model):
+    __tablename__ = 'attendance_rollups'
+    __table_args__ = (
+        # Institution-wide trends read every batch and subject of a date range
+        db.Index('ix_attendance_rollups_day', 'day'),
+    )
+
+    batch_id = db.Column(db.Integer, db.ForeignKey('batches.id'), primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<AttendanceRollup Batch {self.batch_id} Subject {self.subject_id} {self.day}: {self.present}/{self.total}>"
+
+    @staticmethod
+    def day_of(timestamp):
+        return (timestamp + IST_OFFSET).date()
+
+    @staticmethod
+    def apply_deltas(deltas):
+        # Add {(batch_id, subject_id, day): (present, total)} deltas to the rollups in one upsert
+        rows = [
+            {'batch_id': batch_id, 'subject_id': subject_id, 'day': day, 'present': present, 'total': total}
+            for (batch_id, subject_id, day), (present, total) in deltas.items() if present or total
+        ]
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            stmt = dialect_insert(AttendanceRollup).values(rows[start:start + UPSERT_CHUNK_SIZE])
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=[AttendanceRollup.batch_id, AttendanceRollup.subject_id, AttendanceRollup.day],
+                set_={
+                    'present': AttendanceRollup.present + stmt.excluded.present,
+                    'total': AttendanceRollup.total + stmt.excluded.total
+                }
+            ))
+
+    @staticmethod
+    def count(lecture_ids=None):
+        # {(batch_id, subject_id, day): (present, total)} counted from the attendance rows of the
+        # given lectures, or of all of them. Lectures are grouped by the database and days in Python,
+        # as truncating timestamps to local days is not portable SQL.
+        query = db.select(
+            Lecture.batch_id,
+            Lecture.subject_id,
+            Lecture.timestamp,
+            db.func.sum(db.case((Attendance.status == True, 1), else_=0)).label('present'),
+            db.func.count(Attendance.id).label('total')
+        ).join(
+            Attendance, Attendance.lecture_id == Lecture.id
+        ).group_by(
+            Lecture.id, Lecture.batch_id, Lecture.subject_id, Lecture.timestamp
+        )
+        if lecture_ids is not None:
+            query = query.where(Lecture.id.in_(lecture_ids))
+
+        counts = {}
+        for row in db.session.execute(query):
+            key = (row.batch_id, row.subject_id, AttendanceRollup.day_of(row.timestamp))
+            present, total = counts.get(key, (0, 0))
+            counts[key] = (present + row.present, total + row.total)
+        return counts
+
+    @staticmethod
+    def rebuild(dry_run=False, archived_until=None):
+        # Recount the rollups from the attendance rows; returns how many (batch, subject, day) rows had drifted.
+        # archived_until is the end (UTC) of the latest archived term: the rollups of the days before
+        # it count attendance that has left the attendance table and are kept as they are.
+        first_day = AttendanceRollup.day_of(archived_until) if archived_until else None
+        expected = {
+            key: counts for key, counts in AttendanceRollup.count().items()
+            if first_day is None or key[2] >= first_day
+        }
+        stored_rows = db.select(AttendanceRollup)
+        if first_day is not None:
+            stored_rows = stored_rows.where(AttendanceRollup.day >= first_day)
+        stored = {
+            (row.batch_id, row.subject_id, row.day): (row.present, row.total)
+            for row in db.session.scalars(stored_rows)
+        }
+        drifted = sum(
+            1 for key in expected.keys() | stored.keys()
+            if expected.get(key, (0, 0)) != stored.get(key, (0, 0))
+        )
+
+        if drifted and not dry_run:
+            delete = db.delete(AttendanceRollup)
+            if first_day is not None:
+                delete = delete.where(AttendanceRollup.day >= first_day)
+            db.session.execute(delete.execution_options(synchronize_session=False))
+            AttendanceRollup.apply_deltas(expected)
+        return drifted
+
+
+# Outgoing mail waiting to be delivered by the queue worker in mailer.py
+class OutboxMessage(db.Model):
+    __tablename__ = 'mail_outbox'
+    __table_args__ = (
+        db.Index('ix_mail_outbox_due', 'status', 'next_attempt_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(100), nullable=False)
+    recipient = db.Column(db.String(100), nullable=False)
+    reply_to = db.Column(db.String(100))
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(Enum('pending', 'sent', 'failed', name='mail_status'), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<OutboxMessage {self.id} to {self.recipient}: {self.status}>"
+
+
+# Idempotency keys of lectures written through the sync API, so that a retried payload is not applied twice.
+# lecture_id is not a foreign key: the key stays valid after its lecture is deleted or swept.
+class SyncKey(db.Model):
+    __tablename__ = 'sync_keys'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    lecture_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f"<SyncKey {self.key} of User {self.user_id}: Lecture {self.lecture_id}>"
+
+
 class AttendanceStats:
     @staticmethod
     def get_percentage(student_id, subject_id):
@@ -115,7 +481,7 @@ class AttendanceStats:
         result = db.session.query(
             db.func.count(Lecture.id).label('total_lectures'),
             db.func.sum(
-                db.case((Attendance.status == 'TRUE', 1), else_=0)
+                db.case((Attendance.status == True, 1), else_=0)
             ).label('attended_lectures')
         ).outerjoin(
             Attendance, Attendance.lecture_id == Lecture.id
@@ -133,3 +499,198 @@ class AttendanceStats:
 
         percentage = (attended_lectures / total_lectures) * 100
         return round(percentage, 2)  # Return rounded percentage
+
+    @staticmethod
+    def get_batch_report(batch_id, subject_id):
+        # Attended and total lectures of every student in the batch, read from the summary table
+        counts = db.session.query(AttendanceSummary).filter(
+            AttendanceSummary.subject_id == subject_id
+        ).subquery()
+
+        attended = db.func.coalesce(counts.c.attended, 0)
+        total = db.func.coalesce(counts.c.total, 0)
+        percentage = db.func.coalesce(100.0 * attended / db.func.nullif(total, 0), 0)
+
+        # Rank in SQL so students with equal percentages share a rank
+        rank = db.func.rank().over(order_by=percentage.desc())
+
+        rows = db.session.query(
+            Student.id,
+            Student.student_name,
+            Student.enrollment_number,
+            attended.label('attended'),
+            total.label('total'),
+            percentage.label('percentage'),
+            rank.label('rank')
+        ).outerjoin(
+            counts, counts.c.student_id == Student.id
+        ).filter(
+            Student.batch_id == batch_id
+        ).order_by(
+            rank, Student.enrollment_number
+        ).all()
+
+        return [{
+            'student_id': row.id,
+            'student_name': row.student_name,
+            'enrollment_number': row.enrollment_number,
+            'attended': row.attended,
+            'total': row.total,
+            'percentage': round(float(row.percentage), 2),
+            'rank': row.rank
+        } for row in rows]
+
+    @staticmethod
+    def apply_deltas(subject_id, deltas):
+        # Add {student_id: (attended, total)} deltas to the summary in one upsert
+        rows = [
+            {'student_id': student_id, 'subject_id': subject_id, 'attended': attended, 'total': total}
+            for student_id, (attended, total) in deltas.items() if attended or total
+        ]
+        if not rows:
+            return
+
+        stmt = dialect_insert(AttendanceSummary).values(rows)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[AttendanceSummary.student_id, AttendanceSummary.subject_id],
+            set_={
+                'attended': AttendanceSummary.attended + stmt.excluded.attended,
+                'total': AttendanceSummary.total + stmt.excluded.total
+            }
+        ))
+
+    @staticmethod
+    def record_attendance(lecture, statuses):
+        # Write {student_id: status} for a lecture with one upsert and update the summary.
+        # Returns the statuses that changed.
+        return AttendanceStats.record_many([(lecture, statuses)])[0]
+
+    @staticmethod
+    def load_statuses(lecture_ids):
+        # {lecture_id: {student_id: status}} of the records stored for the lectures
+        stored = {}
+        for lecture_id, student_id, status in db.session.execute(
+            db.select(Attendance.lecture_id, Attendance.student_id, Attendance.status)
+            .where(Attendance.lecture_id.in_(lecture_ids))
+        ):
+            stored.setdefault(lecture_id, {})[student_id] = status
+        return stored
+
+    @staticmethod
+    def record_many(sheets):
+        # record_attendance for several (lecture, statuses) sheets at once: the records of all
+        # lectures share the upserts, the summary gets one upsert per subject and the rollups one
+        # in all. Returns the changed statuses of every sheet.
+        #
+        # The counter deltas are worked out from the stored records, read after locking the
+        # lectures, rather than from what the caller saw earlier: two submissions of the same sheet
+        # (a double click, two tabs) take turns, and the second one finds nothing left to change.
+        # Sheets of the same lecture apply in order.
+        lecture_ids = [lecture.id for lecture, _ in sheets]
+        lock_rows(Lecture, lecture_ids)
+        stored = AttendanceStats.load_statuses(lecture_ids)
+
+        changes, rows, deltas, rollup_deltas = [], {}, {}, {}
+        for lecture, statuses in sheets:
+            existing = stored.setdefault(lecture.id, {})
+            changed = {
+                student_id: status for student_id, status in statuses.items()
+                if existing.get(student_id) != status
+            }
+            changes.append(changed)
+            subject_deltas = deltas.setdefault(lecture.subject_id, {})
+            rollup_key = (lecture.batch_id, lecture.subject_id, AttendanceRollup.day_of(lecture.timestamp))
+            for student_id, status in changed.items():
+                attended, total = (1 if status else -1, 0) if student_id in existing else (int(status), 1)
+                previous = subject_deltas.get(student_id, (0, 0))
+                subject_deltas[student_id] = (previous[0] + attended, previous[1] + total)
+                previous = rollup_deltas.get(rollup_key, (0, 0))
+                rollup_deltas[rollup_key] = (previous[0] + attended, previous[1] + total)
+                existing[student_id] = status
+                rows[lecture.id, student_id] = {'lecture_id': lecture.id, 'student_id': student_id, 'status': status}
+        rows = list(rows.values())
+
+        # Chunked to stay under the bound parameter limit of SQLite
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            stmt = dialect_insert(Attendance).values(rows[start:start + UPSERT_CHUNK_SIZE])
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=[Attendance.lecture_id, Attendance.student_id],
+                set_={'status': stmt.excluded.status, 'updated_at': stmt.excluded.updated_at}
+            ))
+
+        for subject_id, subject_deltas in deltas.items():
+            AttendanceStats.apply_deltas(subject_id, subject_deltas)
+        AttendanceRollup.apply_deltas(rollup_deltas)
+
+        if LectureBitmap.enabled():
+            LectureBitmap.refresh(list({lecture.id for (lecture, _), changed in zip(sheets, changes) if changed}))
+        return changes
+
+    @staticmethod
+    def forget_lectures(lecture_ids, keep_rollups=False):
+        # Subtract the attendance of lectures that are about to be deleted from the summary and the
+        # rollups and drop their bitmaps. lecture_ids may be a list or a SELECT of ids. Archived
+        # lectures keep their rollups, so that trends still cover archived terms.
+        removed = db.select(
+            Attendance.student_id,
+            Lecture.subject_id,
+            db.func.sum(db.case((Attendance.status == True, 1), else_=0)).label('attended'),
+            db.func.count(Attendance.id).label('total')
+        ).join(
+            Lecture, Lecture.id == Attendance.lecture_id
+        ).where(
+            Attendance.lecture_id.in_(lecture_ids)
+        ).group_by(
+            Attendance.student_id, Lecture.subject_id
+        ).subquery()
+
+        if not keep_rollups:
+            AttendanceRollup.apply_deltas({
+                key: (-present, -total) for key, (present, total) in AttendanceRollup.count(lecture_ids).items()
+            })
+        db.session.execute(
+            db.delete(LectureBitmap)
+            .where(LectureBitmap.lecture_id.in_(lecture_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            db.update(AttendanceSummary)
+            .where(AttendanceSummary.student_id == removed.c.student_id)
+            .where(AttendanceSummary.subject_id == removed.c.subject_id)
+            .values(
+                attended=AttendanceSummary.attended - removed.c.attended,
+                total=AttendanceSummary.total - removed.c.total
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def rebuild_summary(dry_run=False):
+        # Recount the summary from the attendance rows; returns how many (student, subject) pairs had drifted
+        fresh = db.select(
+            Attendance.student_id,
+            Lecture.subject_id,
+            db.func.sum(db.case((Attendance.status == True, 1), else_=0)).label('attended'),
+            db.func.count(Attendance.id).label('total')
+        ).join(
+            Lecture, Lecture.id == Attendance.lecture_id
+        ).group_by(
+            Attendance.student_id, Lecture.subject_id
+        )
+
+        expected = {(row.student_id, row.subject_id): (row.attended, row.total) for row in db.session.execute(fresh)}
+        stored = {
+            (row.student_id, row.subject_id): (row.attended, row.total)
+            for row in db.session.query(AttendanceSummary)
+        }
+        drifted = sum(
+            1 for key in expected.keys() | stored.keys()
+            if expected.get(key, (0, 0)) != stored.get(key, (0, 0))
+        )
+
+        if drifted and not dry_run:
+            db.session.execute(db.delete(AttendanceSummary).execution_options(synchronize_session=False))
+            db.session.execute(db.insert(AttendanceSummary).from_select(
+                ['student_id', 'subject_id', 'attended', 'total'], fresh
+            ))
+        return drifted
@@ -0,0 +1,121 @@
+"""Cached user principals for Flask-Login.
+
+Every request of a logged-in user loads its user from the session id. When the response cache is
+shared between processes (Redis), the fields the views and templates read (id, name, email,
+is_admin) are kept there under the user's own scope for USER_CACHE_TTL_SECONDS instead of a
+`users` query per request. Committing a change to a user, in a web worker or a CLI command, bumps
+that scope, so the next request of every process sees it. An in-process cache would not see the
+bumps of other processes and keep authenticating revoked sessions, so without a shared cache every
+request reads the user from the database.
+
+The session id is "<user id>:<session version>". Bumping `User.session_version` revokes every
+session of the user: their ids no longer match the principal and load as anonymous.
+"""
+import threading
+from flask_login import UserMixin
+from sqlalchemy import event
+import caching
+from models import db, User
+
+DEFAULT_TTL_SECONDS = 300
+
+
+class UserPrincipal(UserMixin):
+    def __init__(self, id, name, email, is_admin, session_version):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.is_admin = is_admin
+        self.session_version = session_version
+
+    def get_id(self):
+        return f"{self.id}:{self.session_version}"
+
+    def __repr__(self):
+        return f"<UserPrincipal {self.name}>"
+
+    @classmethod
+    def from_user(cls, user):
+        if user is None:
+            return None
+        return cls(user.id, user.name, user.email, user.is_admin, user.session_version)
+
+
+class PrincipalStats:
+    def __init__(self):
+        self.revoked = 0  # Sessions turned away because their version was bumped
+        self._lock = threading.Lock()
+
+    def record_revoked(self):
+        with self._lock:
+            self.revoked += 1
+
+
+stats = PrincipalStats()
+ttl_seconds = DEFAULT_TTL_SECONDS
+
+
+def parse_session_id(session_id):
+    # Sessions from before session versions existed carry the bare user id, which matches version 0
+    user_id, _, version = str(session_id).partition(':')
+    try:
+        return int(user_id), int(version or 0)
+    except ValueError:
+        return None, None
+
+
+def load(session_id):
+    """The principal of a session id, or None when the user is gone or the session was revoked."""
+    user_id, version = parse_session_id(session_id)
+    if user_id is None:
+        return None
+    fetch = lambda: UserPrincipal.from_user(db.session.get(User, user_id))
+    if caching.cache.backend.shared:
+        principal = caching.cached('user-principal', (user_id,), (caching.user_scope(user_id),), fetch, ttl_seconds)
+    else:
+        principal = fetch()
+    if principal is None:
+        return None
+    if principal.session_version != version:
+        stats.record_revoked()
+        return None
+    return principal
+
+
+def revoke_sessions(user):
+    """Log the user out everywhere; takes effect once the caller commits."""
+    user.session_version = (user.session_version or 0) + 1
+
+
+def collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_user_ids', set())
+    changed.update(obj.id for obj in session.dirty | session.deleted if isinstance(obj, User))
+
+
+def bump_changed_users(session):
+    # Only after the commit, so that a request in between cannot cache the old row under the new version
+    for user_id in session.info.pop('changed_user_ids', ()):
+        caching.cache.bump(caching.user_scope(user_id))
+
+
+def forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
+
+
+def init_app(app):
+    global ttl_seconds
+    ttl_seconds = app.config.get('USER_CACHE_TTL_SECONDS') or DEFAULT_TTL_SECONDS
+    event.listen(db.session, 'after_flush', collect_changed_users)
+    event.listen(db.session, 'after_commit', bump_changed_users)
+    event.listen(db.session, 'after_rollback', forget_changed_users)
+
+
+def metrics():
+    # Every cache hit is a users query that did not run
+    return {
+        'cached': caching.cache.backend.shared,
+        'lookups_saved': caching.cache.hits['user-principal'],
+        'lookups': caching.cache.misses['user-principal'],
+        'revoked_sessions_rejected': stats.revoked,
+        'ttl_seconds': ttl_seconds
+    }
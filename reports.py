@@ -0,0 +1,101 @@
+"""Batch-wide defaulter report.
+
+Every student's attendance in every subject of a batch is read from the attendance summary with
+one query and cached until the next attendance or roster write for that batch. The threshold is
+applied to the cached percentages, so trying different limits costs nothing.
+"""
+import csv
+import io
+from collections import OrderedDict
+from caching import cached, batch_scope, ROSTER
+from models import db, Student, Subject, AttendanceSummary
+
+
+class BatchAttendance:
+    def __init__(self, subjects, students):
+        self.subjects = subjects  # [(id, subject_name)] of subjects with attendance in the batch
+        self.students = students  # [{student_id, student_name, enrollment_number, subjects: {subject_id: (attended, total)}}]
+
+    def defaulters(self, threshold):
+        """Students below the threshold in at least one subject, with a cell per subject."""
+        rows = []
+        for student in self.students:
+            cells, below = [], []
+            for subject_id, subject_name in self.subjects:
+                attended, total = student['subjects'].get(subject_id, (0, 0))
+                if not total:
+                    cells.append(None)
+                    continue
+                percentage = round(100 * attended / total, 2)
+                is_below = percentage < threshold
+                cells.append({'attended': attended, 'total': total, 'percentage': percentage, 'below': is_below})
+                if is_below:
+                    below.append(subject_name)
+            if below:
+                rows.append({
+                    'student_id': student['student_id'],
+                    'student_name': student['student_name'],
+                    'enrollment_number': student['enrollment_number'],
+                    'cells': cells,
+                    'below': below
+                })
+        return rows
+
+
+def load_batch_attendance(batch_id):
+    """Attended and total lectures of every student of the batch in every subject, in one query."""
+    rows = db.session.execute(
+        db.select(
+            Student.id, Student.student_name, Student.enrollment_number,
+            Subject.id.label('subject_id'), Subject.subject_name,
+            AttendanceSummary.attended, AttendanceSummary.total
+        ).outerjoin(
+            AttendanceSummary, db.and_(AttendanceSummary.student_id == Student.id, AttendanceSummary.total > 0)
+        ).outerjoin(
+            Subject, Subject.id == AttendanceSummary.subject_id
+        ).where(
+            Student.batch_id == batch_id
+        ).order_by(Student.enrollment_number, Subject.subject_name, Subject.id)
+    ).all()
+
+    subjects = {}
+    students = OrderedDict()
+    for row in rows:
+        student = students.get(row.id)
+        if student is None:
+            student = students[row.id] = {
+                'student_id': row.id,
+                'student_name': row.student_name,
+                'enrollment_number': row.enrollment_number,
+                'subjects': {}
+            }
+        if row.subject_id is not None:
+            subjects[row.subject_id] = row.subject_name
+            student['subjects'][row.subject_id] = (row.attended, row.total)
+
+    ordered = sorted(subjects.items(), key=lambda subject: (subject[1], subject[0]))
+    return BatchAttendance(ordered, list(students.values()))
+
+
+def batch_attendance(batch_id):
+    return cached('batch-attendance', (batch_id,), (batch_scope(batch_id), ROSTER),
+                  lambda: load_batch_attendance(batch_id))
+
+
+def defaulter_report(batch_id, threshold):
+    attendance = batch_attendance(batch_id)
+    return attendance.subjects, attendance.defaulters(threshold)
+
+
+def defaulters_csv(batch_id, threshold):
+    subjects, defaulters = defaulter_report(batch_id, threshold)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Enrollment Number', 'Student Name'] + [name for _, name in subjects] + ['Below Threshold In'])
+    for student in defaulters:
+        writer.writerow(
+            [student['enrollment_number'], student['student_name']] +
+            [f"{cell['percentage']:.2f}" if cell else '' for cell in student['cells']] +
+            ['; '.join(student['below'])]
+        )
+    return buffer.getvalue()
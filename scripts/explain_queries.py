@@ -0,0 +1,78 @@
+"""Print the query plan of every statement the read-only routes issue.
+
+Runs each route through the Flask test client against the database configured in .env
+(SQLALCHEMY_DATABASE_URI), captures the SQL it emits and prints EXPLAIN output for it, so
+index coverage can be checked in review:
+
+    python scripts/explain_queries.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from main import app, encode_cursor
+from models import db, User, Batch, Subject, Lecture
+
+SKIPPED_PREFIXES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', 'SET', 'EXPLAIN')
+
+
+def routes():
+    # (label, method, url, form data) for every read-only route, using rows that exist
+    lecture = Lecture.query.order_by(Lecture.timestamp.desc(), Lecture.id.desc()).first()
+    batch = Batch.query.first()
+    subject = Subject.query.first()
+    if not (lecture and batch and subject):
+        sys.exit("The database needs at least one batch, subject and lecture.")
+
+    return [
+        ("home", 'GET', '/', None),
+        ("older lectures", 'GET', f'/older_lectures?before={encode_cursor(lecture)}', None),
+        ("attendance report", 'POST', '/attendance/', {'subject': subject.id, 'batch': batch.id}),
+        ("mark attendance", 'GET', f'/mark-attendance?lecture_id={lecture.id}', None),
+    ]
+
+
+def explain(connection, statement, parameters):
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        return [f"{'  ' * (row[1] > 0)}{row[-1]}" for row in rows]
+    rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters).all()
+    return [row[0] for row in rows]
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+
+    with app.app_context():
+        user = User.query.first()
+        if user:
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user.id)
+
+        captured = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not statement.lstrip().upper().startswith(SKIPPED_PREFIXES):
+                captured.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        for label, method, url, data in routes():
+            captured.clear()
+            response = client.open(url, method=method, data=data)
+            statements = list(captured)
+            print(f"=== {label}: {method} {url} -> {response.status_code}, {len(statements)} statements")
+
+            with db.engine.connect() as connection:
+                for statement, parameters in statements:
+                    print(f"\n{statement.strip()}")
+                    for line in explain(connection, statement, parameters):
+                        print(f"    {line}")
+            print()
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+
+if __name__ == '__main__':
+    main()
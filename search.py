@@ -0,0 +1,151 @@
+"""Type-ahead search over student names and enrollment numbers.
+
+Every word of the query must prefix-match a word of the student's name or the start of their
+enrollment number: "ar sha" finds "Arjun Sharma" and "0101IT22" the students of IT22. Lookups
+are served by an index, created by `create_index()` (migration 9):
+
+- SQLite: an FTS5 table, `student_search`, over the students table with prefix indexes for
+  two to four characters, kept in step by triggers on students;
+- PostgreSQL: pg_trgm GIN indexes on both columns, which serve the ILIKE patterns below.
+
+Other databases, and SQLite builds without FTS5, fall back to the same ILIKE query without an
+index, which scans the students table.
+"""
+import re
+from models import db, Batch, Student
+
+FTS_TABLE = 'student_search'
+TRIGRAM_INDEXES = {
+    'ix_students_name_trgm': 'student_name',
+    'ix_students_enrollment_trgm': 'enrollment_number',
+}
+MAX_TERMS = 5
+MAX_PER_PAGE = 50
+
+word_re = re.compile(r'\w+')
+
+# Kinds of index found per engine, so that lookups do not query the catalog every time
+index_kinds = {}
+
+
+class SearchError(ValueError):
+    pass
+
+
+def fts_statements():
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"student_name, enrollment_number, content='students', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON students BEGIN "
+        f"INSERT INTO {FTS_TABLE} (rowid, student_name, enrollment_number) "
+        f"VALUES (new.id, new.student_name, new.enrollment_number); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON students BEGIN "
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, student_name, enrollment_number) "
+        f"VALUES ('delete', old.id, old.student_name, old.enrollment_number); END",
+        # Only the indexed columns; bulk updates of other columns leave the index alone
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF student_name, enrollment_number "
+        f"ON students BEGIN "
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, student_name, enrollment_number) "
+        f"VALUES ('delete', old.id, old.student_name, old.enrollment_number); "
+        f"INSERT INTO {FTS_TABLE} (rowid, student_name, enrollment_number) "
+        f"VALUES (new.id, new.student_name, new.enrollment_number); END",
+    ]
+
+
+def sqlite_has_fts5():
+    return bool(db.session.execute(db.text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+
+def create_index():
+    """Create the search index of the current database, if it supports one; returns its kind."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite' and sqlite_has_fts5():
+        for statement in fts_statements():
+            db.session.execute(db.text(statement))
+        # Index the students that existed before the table
+        db.session.execute(db.text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for name, column in TRIGRAM_INDEXES.items():
+            db.session.execute(db.text(
+                f'CREATE INDEX IF NOT EXISTS {name} ON students USING gin ({column} gin_trgm_ops)'
+            ))
+    index_kinds.pop(db.session.get_bind(), None)
+    return index_kind()
+
+
+def index_kind():
+    """'fts5', 'trigram' or None when lookups scan the table."""
+    engine = db.session.get_bind()
+    if engine not in index_kinds:
+        inspector = db.inspect(db.session.connection())
+        if engine.dialect.name == 'sqlite':
+            index_kinds[engine] = 'fts5' if inspector.has_table(FTS_TABLE) else None
+        elif engine.dialect.name == 'postgresql':
+            names = {index['name'] for index in inspector.get_indexes(Student.__tablename__)}
+            index_kinds[engine] = 'trigram' if set(TRIGRAM_INDEXES) <= names else None
+        else:
+            index_kinds[engine] = None
+    return index_kinds[engine]
+
+
+def query_terms(query):
+    """The words of a query, lowercased; at most MAX_TERMS of them."""
+    terms = word_re.findall((query or '').lower())
+    if len(terms) > MAX_TERMS:
+        raise SearchError(f"Search for at most {MAX_TERMS} words at a time.")
+    return terms
+
+
+def fts_match(terms):
+    # Every word as a quoted prefix query, so FTS5 operators typed by the user are plain text
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def like_escape(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def like_filters(terms):
+    # A name matches a word anywhere (the trigram index cannot anchor at word starts); an
+    # enrollment number only from its start
+    return [
+        db.or_(
+            Student.student_name.ilike(f'%{like_escape(term)}%', escape='\\'),
+            Student.enrollment_number.ilike(f'{like_escape(term)}%', escape='\\')
+        )
+        for term in terms
+    ]
+
+
+def search_students(query, page=1, per_page=20):
+    """One page of the students matching a query, by name and enrollment number.
+
+    Returns (students, has_next), with students as rows of id, student_name, enrollment_number,
+    batch_id and batch_name.
+    """
+    if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+        raise SearchError(f"Pages start at 1 and hold 1 to {MAX_PER_PAGE} students.")
+    terms = query_terms(query)
+    if not terms:
+        return [], False
+
+    select = db.select(
+        Student.id, Student.student_name, Student.enrollment_number, Student.batch_id,
+        Batch.name.label('batch_name')
+    ).join(Batch, Batch.id == Student.batch_id).order_by(Student.id)
+    offset, limit = (page - 1) * per_page, per_page + 1  # One more than the page tells whether there is a next one
+    if index_kind() == 'fts5':
+        # The page is cut from the FTS5 table, which returns matches in id order without sorting
+        # them, so that a short prefix matching most students costs no more than a long one
+        matches = db.text(
+            f"SELECT rowid AS id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match "
+            f"ORDER BY rowid LIMIT :limit OFFSET :offset"
+        ).bindparams(match=fts_match(terms), limit=limit, offset=offset).columns(id=db.Integer).subquery()
+        select = select.join(matches, matches.c.id == Student.id)
+    else:
+        select = select.where(*like_filters(terms)).offset(offset).limit(limit)
+
+    rows = db.session.execute(select).all()
+    return rows[:per_page], len(rows) > per_page
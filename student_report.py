@@ -0,0 +1,153 @@
+"""Attendance of a student in every subject of their batch.
+
+The subjects of a student are those with lectures in their batch. Their attended and total
+lectures come from the attendance summary, joined to the batch's lectures grouped by subject in
+one query, and the latest absences from one more; both take any number of students at once, so
+a single student's page and a mentor's list of students cost the same three queries (the
+students, their subjects, their absences).
+"""
+from caching import cached, batch_scope, ROSTER
+from models import db, Batch, Student, Subject, Lecture, Attendance, AttendanceSummary
+
+RECENT_ABSENCES = 10
+MAX_STUDENTS = 100
+
+
+class StudentReportError(ValueError):
+    pass
+
+
+def load_students(enrollment_numbers):
+    """{enrollment_number: row of id, student_name, enrollment_number, batch_id, batch_name}."""
+    rows = db.session.execute(
+        db.select(
+            Student.id, Student.student_name, Student.enrollment_number, Student.batch_id,
+            Batch.name.label('batch_name')
+        ).join(Batch, Batch.id == Student.batch_id)
+        .where(Student.enrollment_number.in_(enrollment_numbers))
+    ).all()
+    return {row.enrollment_number: row for row in rows}
+
+
+def load_subject_counts(student_ids):
+    """{student_id: [(subject_id, subject_name, attended, total)]} over the subjects of each student's batch."""
+    batch_subjects = db.select(
+        Lecture.batch_id, Lecture.subject_id
+    ).where(
+        Lecture.batch_id.in_(db.select(Student.batch_id).where(Student.id.in_(student_ids)))
+    ).group_by(Lecture.batch_id, Lecture.subject_id).subquery()
+
+    rows = db.session.execute(
+        db.select(
+            Student.id.label('student_id'), Subject.id.label('subject_id'), Subject.subject_name,
+            db.func.coalesce(AttendanceSummary.attended, 0).label('attended'),
+            db.func.coalesce(AttendanceSummary.total, 0).label('total')
+        ).join(
+            batch_subjects, batch_subjects.c.batch_id == Student.batch_id
+        ).join(
+            Subject, Subject.id == batch_subjects.c.subject_id
+        ).outerjoin(
+            AttendanceSummary, db.and_(
+                AttendanceSummary.student_id == Student.id,
+                AttendanceSummary.subject_id == batch_subjects.c.subject_id
+            )
+        ).where(
+            Student.id.in_(student_ids)
+        ).order_by(Student.id, Subject.subject_name, Subject.id)
+    ).all()
+
+    counts = {}
+    for row in rows:
+        counts.setdefault(row.student_id, []).append((row.subject_id, row.subject_name, row.attended, row.total))
+    return counts
+
+
+def load_recent_absences(student_ids, limit=RECENT_ABSENCES):
+    """{student_id: [(lecture_id, timestamp, subject_name, sequence_number)]}, latest first."""
+    latest = db.select(
+        Attendance.student_id,
+        Lecture.id.label('lecture_id'),
+        Lecture.timestamp,
+        Lecture.sequence_number,
+        Subject.subject_name,
+        db.func.row_number().over(
+            partition_by=Attendance.student_id, order_by=(Lecture.timestamp.desc(), Lecture.id.desc())
+        ).label('position')
+    ).join(
+        Lecture, Lecture.id == Attendance.lecture_id
+    ).join(
+        Subject, Subject.id == Lecture.subject_id
+    ).where(
+        Attendance.student_id.in_(student_ids), Attendance.status == False
+    ).subquery()
+
+    absences = {}
+    for row in db.session.execute(
+        db.select(latest).where(latest.c.position <= limit).order_by(latest.c.student_id, latest.c.position)
+    ):
+        absences.setdefault(row.student_id, []).append(
+            (row.lecture_id, row.timestamp, row.subject_name, row.sequence_number)
+        )
+    return absences
+
+
+def percentage(attended, total):
+    return round(100 * attended / total, 2) if total else 0
+
+
+def build_reports(students):
+    """Reports of student rows from `load_students`, in the same order."""
+    student_ids = [student.id for student in students]
+    if not student_ids:
+        return []
+    counts = load_subject_counts(student_ids)
+    absences = load_recent_absences(student_ids)
+
+    reports = []
+    for student in students:
+        subjects = [{
+            'subject_id': subject_id,
+            'subject_name': subject_name,
+            'attended': attended,
+            'total': total,
+            'percentage': percentage(attended, total)
+        } for subject_id, subject_name, attended, total in counts.get(student.id, [])]
+        attended = sum(subject['attended'] for subject in subjects)
+        total = sum(subject['total'] for subject in subjects)
+        reports.append({
+            'student_id': student.id,
+            'student_name': student.student_name,
+            'enrollment_number': student.enrollment_number,
+            'batch_id': student.batch_id,
+            'batch': student.batch_name,
+            'attended': attended,
+            'total': total,
+            'percentage': percentage(attended, total),
+            'subjects': subjects,
+            'recent_absences': [{
+                'lecture_id': lecture_id,
+                'timestamp': timestamp,
+                'subject_name': subject_name,
+                'sequence_number': sequence_number
+            } for lecture_id, timestamp, subject_name, sequence_number in absences.get(student.id, [])]
+        })
+    return reports
+
+
+def student_report(enrollment_number):
+    """Report of one student, cached until their batch's attendance or the roster changes; None if unknown."""
+    student = load_students([enrollment_number]).get(enrollment_number)
+    if student is None:
+        return None
+    return cached('student-report', (student.id,), (batch_scope(student.batch_id), ROSTER),
+                  lambda: build_reports([student])[0])
+
+
+def student_reports(enrollment_numbers):
+    """Reports of many students, in the order asked for, and the enrollment numbers that were not found."""
+    enrollment_numbers = list(dict.fromkeys(enrollment_numbers))
+    if len(enrollment_numbers) > MAX_STUDENTS:
+        raise StudentReportError(f"Ask for at most {MAX_STUDENTS} students at a time.")
+    students = load_students(enrollment_numbers)
+    found = [students[number] for number in enrollment_numbers if number in students]
+    return build_reports(found), [number for number in enrollment_numbers if number not in students]
@@ -0,0 +1,79 @@
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+import caching
+from models import db, Lecture, Attendance, AttendanceStats
+
+logger = logging.getLogger(__name__)
+
+
+def stale_lecture_ids(cutoff, batch_size):
+    # Ids of a batch of lectures older than the cutoff without a single student marked present.
+    # Read once per pass, so that every statement of the pass works on the same lectures even when
+    # attendance is committed in between; the rows stay locked until the pass commits.
+    return db.session.scalars(
+        db.select(Lecture.id).where(
+            Lecture.timestamp < cutoff,
+            ~db.exists().where(Attendance.lecture_id == Lecture.id, Attendance.status == True)
+        ).order_by(Lecture.id).limit(batch_size).with_for_update()
+    ).all()
+
+
+def sweep_stale_lectures(grace_period=timedelta(minutes=30), batch_size=500):
+    """Delete empty and all-absent lectures older than the grace period.
+
+    Works in bounded batches, each committed separately, and returns the number of
+    lectures and attendance records removed.
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - grace_period
+    lectures_removed = 0
+    attendance_removed = 0
+
+    while True:
+        batch = stale_lecture_ids(cutoff, batch_size)
+        if not batch:
+            break
+        subject_ids = db.session.scalars(
+            db.select(Lecture.subject_id).where(Lecture.id.in_(batch)).distinct()
+        ).all()
+
+        AttendanceStats.forget_lectures(batch)
+        attendance_removed += db.session.execute(
+            db.delete(Attendance)
+            .where(Attendance.lecture_id.in_(batch))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        deleted = db.session.execute(
+            db.delete(Lecture)
+            .where(Lecture.id.in_(batch))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        lectures_removed += deleted
+
+        Lecture.renumber(subject_ids)
+        db.session.commit()
+        caching.cache.clear()
+
+        if deleted < batch_size:
+            break
+
+    return lectures_removed, attendance_removed
+
+
+def start_sweeper(app, interval, grace_period, batch_size):
+    """Run the sweeper every `interval` on a daemon thread."""
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval.total_seconds()):
+            with app.app_context():
+                try:
+                    lectures, attendance = sweep_stale_lectures(grace_period, batch_size)
+                    if lectures:
+                        logger.info("Swept %d stale lectures and %d attendance records.", lectures, attendance)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Stale lecture sweep failed.")
+
+    threading.Thread(target=run, name='lecture-sweeper', daemon=True).start()
+    return stopped
@@ -0,0 +1,211 @@
+"""Batched attendance sync for clients that mark attendance offline.
+
+A payload carries several lectures, each with an idempotency key chosen by the client and the
+students marked present and absent:
+
+    {"lectures": [
+        {"key": "3f0c...", "subject_id": 2, "batch_id": 1, "timestamp": "2024-09-02T09:00:00Z",
+         "present": [11, 12], "absent": [13]},
+        {"key": "9a41...", "lecture_id": 57, "present": [13]}
+    ]}
+
+An entry with subject_id and batch_id creates a lecture; students of the batch it does not list
+are marked absent, as on the marking form. An entry with lecture_id changes only the students
+it lists. Every valid entry is written in one transaction, with the records of all lectures in
+shared upserts, and its key is stored with it: a key that was already synced is answered with
+its lecture instead of being applied again. Invalid entries are rejected one by one without
+holding back the others.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import exc
+import caching
+from models import db, Batch, Student, Subject, Lecture, AttendanceStats, SyncKey, lock_rows
+
+MAX_LECTURES = 50
+KEY_LENGTH = 64
+
+
+class SyncError(ValueError):
+    pass
+
+
+def parse_timestamp(value):
+    # ISO 8601; a timestamp without an offset is taken as UTC
+    if value is None:
+        return datetime.now(timezone.utc)
+    try:
+        timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise SyncError("timestamp must be an ISO 8601 date and time.")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    timestamp = timestamp.astimezone(timezone.utc)
+    if timestamp > datetime.now(timezone.utc):
+        raise SyncError("timestamp is in the future.")
+    return timestamp
+
+
+def parse_students(entry, name):
+    students = entry.get(name, [])
+    if not isinstance(students, list) or not all(isinstance(s, int) and not isinstance(s, bool) for s in students):
+        raise SyncError(f"{name} must be a list of student ids.")
+    return set(students)
+
+
+def int_field(entry, name):
+    value = entry.get(name)
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def parse_payload(payload):
+    """Validate the shape of a payload and return its list of lecture entries."""
+    lectures = payload.get('lectures') if isinstance(payload, dict) else None
+    if not isinstance(lectures, list) or not lectures:
+        raise SyncError("lectures must be a non-empty list.")
+    if len(lectures) > MAX_LECTURES:
+        raise SyncError(f"At most {MAX_LECTURES} lectures can be synced at once.")
+    return lectures
+
+
+class SyncState:
+    # Everything an entry is checked against, read with one query per table for the whole payload
+    def __init__(self, user, entries):
+        dicts = [entry for entry in entries if isinstance(entry, dict)]
+        keys = {str(entry.get('key')) for entry in dicts}
+        lecture_ids = {int_field(entry, 'lecture_id') for entry in dicts} - {None}
+
+        self.synced = dict(db.session.execute(
+            db.select(SyncKey.key, SyncKey.lecture_id).where(SyncKey.user_id == user.id, SyncKey.key.in_(keys))
+        ).all())
+        self.lectures = {
+            lecture.id: lecture for lecture in db.session.scalars(db.select(Lecture).where(Lecture.id.in_(lecture_ids)))
+        }
+        self.subject_ids = set(db.session.scalars(db.select(Subject.id).where(Subject.teacher_id == user.id)))
+        self.batch_ids = set(db.session.scalars(db.select(Batch.id)))
+
+        batch_ids = {lecture.batch_id for lecture in self.lectures.values()}
+        batch_ids.update(int_field(entry, 'batch_id') for entry in dicts)
+        self.rosters = {}
+        for student_id, batch_id in db.session.execute(
+            db.select(Student.id, Student.batch_id).where(Student.batch_id.in_(batch_ids))
+        ):
+            self.rosters.setdefault(batch_id, set()).add(student_id)
+
+
+def check_key(entry, seen_keys):
+    if not isinstance(entry, dict):
+        raise SyncError("Every lecture must be an object.")
+    key = entry.get('key')
+    if not isinstance(key, str) or not 0 < len(key) <= KEY_LENGTH:
+        raise SyncError(f"key must be a string of 1 to {KEY_LENGTH} characters.")
+    if key in seen_keys:
+        raise SyncError("key is used by another lecture of this payload.")
+    seen_keys.add(key)
+    return key
+
+
+def plan_entry(entry, user, state):
+    """Check an entry; returns the lecture (or the values of a new one) and the statuses to write."""
+    present = parse_students(entry, 'present')
+    absent = parse_students(entry, 'absent')
+    if present & absent:
+        raise SyncError("A student cannot be both present and absent.")
+
+    if 'lecture_id' in entry:
+        lecture = state.lectures.get(int_field(entry, 'lecture_id'))
+        if lecture is None:
+            raise SyncError(f"Lecture {entry['lecture_id']} was not found.")
+        if lecture.teacher_id != user.id:
+            raise SyncError("You are not authorized to mark attendance for this lecture.")
+        roster = state.rosters.get(lecture.batch_id, set())
+        statuses = dict.fromkeys(absent, False)
+    else:
+        subject_id, batch_id = int_field(entry, 'subject_id'), int_field(entry, 'batch_id')
+        if subject_id not in state.subject_ids:
+            raise SyncError("subject_id must be one of your subjects.")
+        if batch_id not in state.batch_ids:
+            raise SyncError("batch_id must be an existing batch.")
+        lecture = {
+            'subject_id': subject_id,
+            'batch_id': batch_id,
+            'teacher_id': user.id,
+            'timestamp': parse_timestamp(entry.get('timestamp'))
+        }
+        roster = state.rosters.get(batch_id, set())
+        statuses = dict.fromkeys(roster, False)
+
+    strangers = (present | absent) - roster
+    if strangers:
+        raise SyncError(f"Students {sorted(strangers)} are not in the lecture's batch.")
+    statuses.update(dict.fromkeys(present, True))
+    return lecture, statuses
+
+
+def apply(user, entries):
+    """Write the valid entries in one transaction; returns the per-entry results in payload order."""
+    state = SyncState(user, entries)
+    results, plans, seen_keys = [], [], set()
+    for entry in entries:
+        result = {'key': entry.get('key') if isinstance(entry, dict) else None}
+        results.append(result)
+        try:
+            key = check_key(entry, seen_keys)
+            if key in state.synced:
+                result.update(status='duplicate', lecture_id=state.synced[key])
+                continue
+            lecture, statuses = plan_entry(entry, user, state)
+        except SyncError as error:
+            result.update(status='rejected', message=str(error))
+            continue
+        if isinstance(lecture, dict):
+            lecture = Lecture(**lecture)
+            db.session.add(lecture)
+            result['status'] = 'created'
+        else:
+            result['status'] = 'updated'
+        plans.append((result, key, lecture, statuses))
+
+    # New lectures are inserted with one flush, then numbered along with the rest of their subject.
+    # The subjects stay locked until the commit, so that concurrent renumberings see each other's lectures.
+    new_subjects = {lecture.subject_id for result, _, lecture, _ in plans if result['status'] == 'created'}
+    lock_rows(Subject, new_subjects)
+    db.session.flush()
+    if new_subjects:
+        Lecture.renumber(new_subjects)
+
+    sheets = []
+    for result, key, lecture, statuses in plans:
+        result['lecture_id'] = lecture.id
+        sheets.append((lecture, statuses))
+        db.session.add(SyncKey(user_id=user.id, key=key, lecture_id=lecture.id))
+    changes = AttendanceStats.record_many(sheets)
+    db.session.commit()
+
+    for (result, _, lecture, _), changed in zip(plans, changes):
+        result['changed'] = len(changed)
+        if result['status'] == 'created':
+            caching.lectures_changed(lecture.batch_id, lecture.subject_id)
+        elif changed:
+            caching.attendance_changed(lecture)
+
+    # Sequence numbers after the renumbering, for new, updated and duplicate lectures alike
+    lecture_ids = [result['lecture_id'] for result in results if 'lecture_id' in result]
+    numbers = dict(db.session.execute(
+        db.select(Lecture.id, Lecture.sequence_number).where(Lecture.id.in_(lecture_ids))
+    ).all()) if lecture_ids else {}
+    for result in results:
+        if 'lecture_id' in result:
+            result['sequence_number'] = numbers.get(result['lecture_id'])
+    return results
+
+
+def sync(user, payload):
+    """Apply a sync payload for a teacher; raises SyncError when the payload itself is malformed."""
+    entries = parse_payload(payload)
+    try:
+        return apply(user, entries)
+    except exc.IntegrityError:
+        # A concurrent retry of the same payload stored one of its keys first; run again so those
+        # entries are answered as duplicates
+        db.session.rollback()
+        return apply(user, entries)
@@ -0,0 +1,116 @@
+"""Query counts of the lecture feed, attendance marking and offline sync.
+
+These routes issue the same statements however many lectures, students and attendance records
+there are. Every route is checked with `instrumentation.assert_max_queries` against a small demo
+database and one with ten times the lectures and four times the students, with the same limit:
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+DIRECTORY = tempfile.TemporaryDirectory()
+# Read by main at import time; caching stays off so that every request does its real work
+os.environ.update(
+    SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(DIRECTORY.name, 'queries.db')}",
+    SECRET_KEY='test',
+    MAIL_INTERVAL_SECONDS='0',
+    SWEEP_INTERVAL_MINUTES='0',
+    CACHE_URL='none'
+)
+
+import demo
+import migrations
+from instrumentation import assert_max_queries
+from main import app, encode_cursor
+from models import db, User, Lecture, Student
+
+# Statements per request, the user's session included. Writes skip the rollup upsert when a
+# submission leaves the day's counts unchanged, so they may run one fewer.
+MAX_QUERIES = {
+    'home': 3,
+    'older lectures': 3,
+    'mark attendance': 9,
+    'sync': 13,
+}
+
+
+class QueryCountTests:
+    # (batches, students per batch, lectures per batch) of the demo database
+    size = None
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['WTF_CSRF_ENABLED'] = False
+        with app.app_context():
+            db.drop_all()
+            migrations.upgrade(echo=lambda message: None)
+            demo.seed_demo(*cls.size)
+
+            teacher = db.session.scalar(db.select(User).where(User.email == 'teacher1@example.com'))
+            cls.lecture_id = db.session.scalar(
+                db.select(Lecture.id).where(Lecture.teacher_id == teacher.id)
+                .order_by(Lecture.timestamp.desc()).limit(1)
+            )
+            batch_id = db.session.get(Lecture, cls.lecture_id).batch_id
+            cls.student_ids = db.session.scalars(
+                db.select(Student.id).where(Student.batch_id == batch_id).order_by(Student.id)
+            ).all()
+            cls.cursor = encode_cursor(db.session.scalar(
+                db.select(Lecture).order_by(Lecture.timestamp.desc(), Lecture.id.desc())
+                .offset(app.config['LECTURES_PER_PAGE'] - 1).limit(1)
+            ))
+
+    @classmethod
+    def tearDownClass(cls):
+        with app.app_context():
+            db.engine.dispose()
+
+    def setUp(self):
+        self.client = app.test_client()
+        response = self.client.post('/login', data={'email': 'teacher1@example.com', 'password': demo.DEMO_PASSWORD})
+        self.assertEqual(response.status_code, 302)
+
+    def assert_queries(self, route, method, url, **kwargs):
+        with app.app_context(), assert_max_queries(MAX_QUERIES[route]):
+            response = self.client.open(url, method=method, **kwargs)
+            response.get_data()
+        self.assertIn(response.status_code, (200, 302), route)
+
+    def test_home(self):
+        self.assert_queries('home', 'GET', '/')
+
+    def test_older_lectures(self):
+        self.assert_queries('older lectures', 'GET', f'/older_lectures?before={self.cursor}')
+
+    def test_mark_attendance(self):
+        # Both halves of the class change, so that every submission writes
+        for iteration in range(2):
+            self.assert_queries(
+                'mark attendance', 'POST', f'/mark-attendance?lecture_id={self.lecture_id}',
+                data={f'attendance_{student_id}': 'on'
+                      for i, student_id in enumerate(self.student_ids) if (i + iteration) % 2}
+            )
+
+    def test_sync(self):
+        for iteration in range(2):
+            self.assert_queries('sync', 'POST', '/api/sync', json={'lectures': [{
+                'key': f'test-{iteration}', 'lecture_id': self.lecture_id,
+                'present': self.student_ids[iteration::2], 'absent': self.student_ids[1 - iteration::2]
+            }]})
+
+
+class SmallDatabaseQueryCountTests(QueryCountTests, unittest.TestCase):
+    size = (2, 10, 20)
+
+
+class LargeDatabaseQueryCountTests(QueryCountTests, unittest.TestCase):
+    size = (4, 40, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Attendance trends read from the daily rollups.
+
+The attendance_rollups table holds present and total marks per batch, subject and IST day, and
+is updated along with every attendance write. A trend sums the rollups of the chosen batch and
+subject (or of all of them) per day in the database, so a year is at most 366 rows whatever the
+number of batches, subjects and students, and folds the days into weeks or months here.
+"""
+from datetime import timedelta
+from models import db, AttendanceRollup
+
+PERIODS = ('day', 'week', 'month')
+
+
+class TrendsError(ValueError):
+    pass
+
+
+def period_start(day, period):
+    # Weeks start on Monday
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def attendance_trends(period='week', batch_id=None, subject_id=None, start=None, end=None):
+    """[{start, present, total, percentage}] per period, oldest first, of the days start to end (inclusive).
+
+    Periods without any attendance are left out.
+    """
+    if period not in PERIODS:
+        raise TrendsError(f"period must be one of {', '.join(PERIODS)}.")
+    if start and end and start > end:
+        raise TrendsError("start must not be after end.")
+
+    query = db.select(
+        AttendanceRollup.day,
+        db.func.sum(AttendanceRollup.present).label('present'),
+        db.func.sum(AttendanceRollup.total).label('total')
+    ).group_by(AttendanceRollup.day).order_by(AttendanceRollup.day)
+    if batch_id is not None:
+        query = query.where(AttendanceRollup.batch_id == batch_id)
+    if subject_id is not None:
+        query = query.where(AttendanceRollup.subject_id == subject_id)
+    if start:
+        query = query.where(AttendanceRollup.day >= start)
+    if end:
+        query = query.where(AttendanceRollup.day <= end)
+
+    periods = {}
+    for day, present, total in db.session.execute(query):
+        key = period_start(day, period)
+        counts = periods.setdefault(key, [0, 0])
+        counts[0] += present
+        counts[1] += total
+
+    return [{
+        'start': key,
+        'present': present,
+        'total': total,
+        'percentage': round(100 * present / total, 2)
+    } for key, (present, total) in periods.items() if total]